@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+# number of set bits of every byte, for numpy without bitwise_count
+_BIT_COUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def _popcount(bytes_):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bytes_)
+    return _BIT_COUNT[bytes_]
+
+
+class Availability:
+    '''
+    valid - dates x codes boolean matrix, True where a code has data (e.g. PriceStore.valid),
+            or a value matrix with nan where a code has no data
+    codes - code of every column
+    dates - date of every row
+    chunk_rows - rows of valid packed at once, bounds the memory used for a memory-mapped valid
+
+    Availability of every code over the trading calendar as packed bits, one contiguous bitmap per
+    code (8 dates per byte). "Has data on every date of a window" and "dates both codes of a pair
+    have data on" are bitwise AND and popcount on a few bytes per code, so pairs with missing data
+    are rejected before any price is sliced. Windows are rows [start, stop) of the calendar.
+    '''
+
+    def __init__(self, valid, codes, dates=None, chunk_rows=8*4096):
+        self.codes = np.asarray(codes)
+        self.dates = None if dates is None else pd.DatetimeIndex(dates)
+        self.code_index = dict(zip(self.codes, range(len(self.codes))))
+        self.date_num = valid.shape[0]
+        self.bits = np.empty((valid.shape[1], (valid.shape[0] + 7)//8), dtype=np.uint8)
+        for start in range(0, valid.shape[0], chunk_rows):
+            block = np.asarray(valid[start: start + chunk_rows])
+            block = ~np.isnan(block) if block.dtype.kind == 'f' else block.astype(bool)
+            self.bits[:, start//8: start//8 + (len(block) + 7)//8] = np.packbits(block, axis=0).T
+
+    @classmethod
+    def from_frame(cls, price):
+        '''
+        price - dates x codes DataFrame, nan where a code has no data
+        '''
+        return cls(price.values, price.columns.values, price.index)
+
+    def columns(self, codes):
+        '''
+        Column positions of the codes
+        '''
+        return np.array([self.code_index[code] for code in codes], dtype=np.intp)
+
+    def _window(self, start, stop):
+        # byte range of rows [start, stop) and the mask of those rows inside it
+        stop = self.date_num if stop is None else stop
+        first, last = start//8, (stop + 7)//8
+        rows = np.arange(first*8, last*8)
+        return slice(first, last), np.packbits((rows >= start) & (rows < stop)), stop - start
+
+    def count(self, start=0, stop=None, codes=None):
+        '''
+        Number of dates with data of every code (or of the codes) in the window
+        '''
+        window, mask, _ = self._window(start, stop)
+        bits = self.bits[:, window] if codes is None else self.bits[self.columns(codes), window]
+        return _popcount(bits & mask).sum(axis=1, dtype=np.int64)
+
+    def full(self, start=0, stop=None, codes=None):
+        '''
+        Whether every code (or each of the codes) has data on every date of the window
+        '''
+        return self.count(start, stop, codes) == self._window(start, stop)[2]
+
+    def eligible(self, start=0, stop=None):
+        '''
+        Codes with data on every date of the window
+        '''
+        return self.codes[self.full(start, stop)]
+
+    def pair_count(self, pairs, start=0, stop=None):
+        '''
+        pairs - (code_1, code_2) tuples, or a (pairs x 2) array of column positions
+
+        Number of dates both codes of each pair have data on in the window
+        '''
+        pairs = self._pair_columns(pairs)
+        window, mask, _ = self._window(start, stop)
+        common = self.bits[pairs[:, 0], window] & self.bits[pairs[:, 1], window] & mask
+        return _popcount(common).sum(axis=1, dtype=np.int64)
+
+    def pair_full(self, pairs, start=0, stop=None):
+        '''
+        Whether both codes of each pair have data on every date of the window
+        '''
+        return self.pair_count(pairs, start, stop) == self._window(start, stop)[2]
+
+    def _pair_columns(self, pairs):
+        if isinstance(pairs, np.ndarray) and pairs.dtype.kind in 'iu':
+            return pairs.reshape(-1, 2)
+        return np.array(
+            [(self.code_index[code_1], self.code_index[code_2]) for code_1, code_2 in pairs],
+            dtype=np.intp
+        ).reshape(-1, 2)
+
+    def common_rows(self, code_1, code_2, start=0, stop=None):
+        '''
+        Rows of the window both codes have data on
+        '''
+        window, mask, _ = self._window(start, stop)
+        column_1, column_2 = self.code_index[code_1], self.code_index[code_2]
+        common = self.bits[column_1, window] & self.bits[column_2, window] & mask
+        return np.flatnonzero(np.unpackbits(common)) + window.start*8
+
+    def align(self, values, code_1, code_2, start=0, stop=None):
+        '''
+        values - dates x codes matrix on the same calendar and codes (e.g. PriceStore.values['price'])
+
+        Rows both codes have data on and the two aligned value arrays. The arrays are views of
+        values when those rows are contiguous (always the case for a pair with full data), copies otherwise.
+        '''
+        rows = self.common_rows(code_1, code_2, start, stop)
+        column_1, column_2 = self.code_index[code_1], self.code_index[code_2]
+        if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+            rows_slice = slice(rows[0], rows[-1] + 1)
+            return rows, values[rows_slice, column_1], values[rows_slice, column_2]
+        return rows, values[rows, column_1], values[rows, column_2]
@@ -0,0 +1,171 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.stats import norm
+
+# MacKinnon (1994) response surfaces of the ADF t-statistic with one unit root,
+# same tables as arch.unitroot.critical_values.dickey_fuller (coefficients in ascending order)
+_MACKINNON = {
+    'nc': {
+        'max': np.inf, 'min': -19.04, 'star': -1.04,
+        'small': np.array([0.6344, 1.2378, 3.2496e-2]),
+        'large': np.array([0.4797, 9.3557e-1, -0.6999e-1, 3.3066e-2]),
+    },
+    'c': {
+        'max': 2.74, 'min': -18.83, 'star': -1.61,
+        'small': np.array([2.1659, 1.4412, 3.8269e-2]),
+        'large': np.array([1.7339, 9.3202e-1, -1.2745e-1, -1.0368e-2]),
+    },
+}
+
+
+def _trend(trend):
+    # "n" is the name of "nc" in newer versions of arch
+    if trend in ('nc', 'n'):
+        return 'nc'
+    if trend == 'c':
+        return 'c'
+    raise Exception('Wrong input of trend!')
+
+
+def mackinnon_pvalue(stat, trend='c'):
+    '''
+    stat - ADF t-statistics (array)
+    trend - c or n (nc)
+
+    MacKinnon's approximate p-values of many statistics at once, same as arch's mackinnonp
+    '''
+    table = _MACKINNON[_trend(trend)]
+    stat = np.asarray(stat, dtype=float)
+    small = np.polynomial.polynomial.polyval(stat, table['small'])
+    large = np.polynomial.polynomial.polyval(stat, table['large'])
+    pvalue = norm.cdf(np.where(stat <= table['star'], small, large))
+    pvalue = np.where(stat > table['max'], 1.0, pvalue)
+    return np.where(stat < table['min'], 0.0, pvalue)
+
+
+def default_max_lags(nobs, trend='c'):
+    '''
+    12*(nobs/100)^(1/4) capped by the length of the series, as in arch
+    '''
+    limit = max((nobs - 1)//2 - 1, 0) - (1 if _trend(trend) == 'c' else 0)
+    return max(min(int(np.ceil(12.0*np.power(nobs/100.0, 1/4.0))), limit), 0)
+
+
+def _design(y, lags, rows, constant):
+    # (series, rows, columns) design of the ADF regression: [constant], level, lagged differences.
+    # The lagged differences are a strided view of the differences, copied once into the design.
+    delta_y = np.diff(y, axis=0)
+    lagged = sliding_window_view(delta_y, lags + 1, axis=0)[-rows:]
+    columns = [y[-rows - 1: -1].T[:, :, None], lagged[:, :, ::-1][:, :, 1:].transpose(1, 0, 2)]
+    if constant:
+        columns.insert(0, np.ones((y.shape[1], rows, 1)))
+    return np.concatenate(columns, axis=2), delta_y[-rows:].T
+
+
+def _singular(xpx):
+    # numerically singular systems of the stack
+    # (smallest eigenvalue below the tolerance of numpy's matrix_rank)
+    eigenvalues = np.linalg.eigvalsh(xpx)
+    return eigenvalues[:, 0] <= eigenvalues[:, -1]*xpx.shape[-1]*np.finfo(float).eps
+
+
+def _solve_stack(function, xpx, *args):
+    # np.linalg.solve or inv of the whole stack and the mask of singular systems. numpy raises for the
+    # whole stack when one system is singular (e.g. the regression of a constant series), only then
+    # the singular systems are found and replaced by an identity so the other series are still solved
+    try:
+        return function(xpx, *args), np.zeros(len(xpx), dtype=bool)
+    except np.linalg.LinAlgError:
+        singular = _singular(xpx)
+        return function(np.where(singular[:, None, None], np.eye(xpx.shape[-1]), xpx), *args), singular
+
+
+def _exact_fit(residual_square, total_square):
+    # residuals at the rounding level of the differences: the regression fits exactly
+    return ~(residual_square > np.finfo(float).eps*total_square)
+
+
+def _select_lags(y, max_lags, constant, method):
+    # information criterion of every lag length on the common sample of max_lags, for all series
+    rows = y.shape[0] - 1 - max_lags
+    X, lhs = _design(y, max_lags, rows, constant)
+    xpx = X.transpose(0, 2, 1) @ X
+    xpy = np.einsum('stk,st->sk', X, lhs)
+    ypy = np.einsum('st,st->s', lhs, lhs)
+
+    start = 2 if constant else 1
+    sigma2 = np.empty((y.shape[1], max_lags + 1))
+    for lags in range(max_lags + 1):
+        k = start + lags
+        b, singular = _solve_stack(np.linalg.solve, xpx[:, :k, :k], xpy[:, :k, None])
+        b = b[:, :, 0]
+        sigma2[:, lags] = (ypy - np.einsum('sk,sk->s', b, xpy[:, :k]))/rows
+        # a lag length without a proper fit is never selected
+        sigma2[singular | _exact_fit(sigma2[:, lags]*rows, ypy), lags] = np.inf
+
+    log_likelihood = -rows/2.0*(np.log(2*np.pi) + np.log(sigma2) + 1)
+    penalty = 2.0 if method == 'aic' else np.log(rows)
+    criterion = -2*log_likelihood + penalty*np.arange(max_lags + 1)
+    # argmin keeps the shortest lag on ties, like arch
+    return criterion.argmin(axis=1)
+
+
+def _statistic(y, lags, constant):
+    # t-statistic of the level in the ADF regression with the given lags, on its full sample
+    rows = y.shape[0] - 1 - lags
+    X, lhs = _design(y, lags, rows, constant)
+    xpx = X.transpose(0, 2, 1) @ X
+    xpy = np.einsum('stk,st->sk', X, lhs)
+    xpx_inverse, singular = _solve_stack(np.linalg.inv, xpx)
+    b = np.einsum('sij,sj->si', xpx_inverse, xpy)
+    residual = lhs - np.einsum('stk,sk->st', X, b)
+    residual_square = np.einsum('st,st->s', residual, residual)
+    s2 = residual_square/(rows - X.shape[2])
+    level = 1 if constant else 0
+    # singular systems and zero residuals have no statistic
+    degenerate = singular | _exact_fit(residual_square, np.einsum('st,st->s', lhs, lhs))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat = b[:, level]/np.sqrt(s2*xpx_inverse[:, level, level])
+    return np.where(degenerate, np.nan, stat)
+
+
+def batch_ADF(y, trend='c', lags=None, max_lags=None, method='aic', chunk_size=1024):
+    '''
+    y - observations x series array, every column is tested on its own
+    trend - c (constant) or n (no constant, nc in older versions of arch)
+    lags - number of lagged differences, None selects it for each series by method
+    max_lags - largest number of lags searched, None uses 12*(nobs/100)^(1/4) as arch
+    method - aic or bic
+    chunk_size - number of series solved together, bounds the memory of the designs
+
+    Augmented Dickey-Fuller test of many series of the same length at once, agrees with
+    arch.unitroot.ADF(y[:, i], trend=trend) up to rounding: the designs are built from strided
+    views of the differences and every regression of the batch is solved as one stacked
+    least-squares problem. Returns (stat, pvalue, lags) arrays, one value per series.
+    A degenerate series (singular regression, e.g. a constant series, or zero residual) gets
+    stat nan and p-value 1 instead of raising for the whole batch.
+    '''
+    y = np.asarray(y, dtype=float)
+    if y.ndim == 1:
+        y = y[:, None]
+    constant = _trend(trend) == 'c'
+    method = method.lower()
+    if method not in ('aic', 'bic'):
+        raise Exception('Wrong input of method!')
+    if max_lags is None:
+        max_lags = default_max_lags(y.shape[0], trend)
+
+    stat = np.empty(y.shape[1])
+    selected = np.empty(y.shape[1], dtype=int)
+    for start in range(0, y.shape[1], chunk_size):
+        chunk = y[:, start: start + chunk_size]
+        chunk_lags = (
+            np.full(chunk.shape[1], lags) if lags is not None
+            else _select_lags(chunk, max_lags, constant, method)
+        )
+        selected[start: start + chunk.shape[1]] = chunk_lags
+        # the final regression uses the whole sample of the selected lag length
+        for lag in np.unique(chunk_lags):
+            column = np.flatnonzero(chunk_lags == lag)
+            stat[start + column] = _statistic(chunk[:, column], lag, constant)
+    return stat, np.where(np.isnan(stat), 1.0, mackinnon_pvalue(stat, trend)), selected
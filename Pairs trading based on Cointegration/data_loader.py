@@ -0,0 +1,149 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# bump when the layout of the cached tables changes
+CACHE_VERSION = 1
+
+
+def read_price_csv(path, columns=('code', 'name', 'date', 'price'), price_dtype='float32'):
+    '''
+    path - long-format csv, e.g. finance_data.csv
+    columns - new column names in the order of the csv, must contain code, date and price
+    price_dtype - dtype of the price column
+
+    Same table as the data loading cell of the simulation notebook (date, year, month,
+    week, dayofweek), read with compact dtypes: int32 codes (category if they are not
+    numbers), category names, int32 yyyymmdd dates turned into datetime by arithmetic
+    instead of strptime row by row. Sorted by date as in the notebook.
+    '''
+    raw_columns = pd.read_csv(path, nrows=0).columns
+    if len(raw_columns) != len(columns):
+        raise Exception('Wrong number of columns!')
+    dtype = {'code': 'object', 'name': 'category', 'date': 'int32', 'price': price_dtype}
+    data = pd.read_csv(
+        path, header=0, names=list(columns),
+        dtype={column: dtype[column] for column in columns if column in dtype}
+    )
+
+    code = pd.to_numeric(data.code, errors='coerce')
+    if code.notna().all() and (code == code.round()).all():
+        data['code'] = code.astype('int32')
+    else:
+        data['code'] = data.code.astype('category')
+
+    data = pd.concat([data, calendar_fields(data.date.values)], axis=1)
+    data['date'] = data.pop('date_time')
+    return data.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def calendar_fields(yyyymmdd):
+    '''
+    yyyymmdd - integer dates, e.g. 20150102
+
+    date_time, year, month, week (ISO week, same as Timestamp.week) and dayofweek of every date,
+    computed once per distinct date and broadcast back
+    '''
+    unique_date, inverse = np.unique(np.asarray(yyyymmdd), return_inverse=True)
+    date_time = pd.to_datetime(pd.DataFrame({
+        'year': unique_date // 10000,
+        'month': unique_date // 100 % 100,
+        'day': unique_date % 100
+    }))
+    date_time = pd.DatetimeIndex(date_time)
+    return pd.DataFrame({
+        'date_time': date_time[inverse],
+        'year': date_time.year.values.astype('int16')[inverse],
+        'month': date_time.month.values.astype('int8')[inverse],
+        'week': date_time.isocalendar().week.values.astype('int8')[inverse],
+        'dayofweek': date_time.dayofweek.values.astype('int8')[inverse]
+    })
+
+
+def trading_calendar(data):
+    '''
+    data - result of read_price_csv
+
+    Returns (date, timeframe) of the simulation notebook:
+    date - every trading date with year, month, week, dayofweek
+    timeframe - one row per (year, month, week) in trading order, with the first and last
+                trading date of the week (first_date, last_date) and their rows in date
+                (first_row, last_row), so a window of weeks is a row slice of date
+    '''
+    date = data[['date', 'year', 'month', 'week', 'dayofweek']].drop_duplicates('date')
+    date = date.sort_values('date').reset_index(drop=True)
+
+    key = date[['year', 'month', 'week']]
+    is_new_week = (key != key.shift()).any(axis=1).values
+    first_row = np.flatnonzero(is_new_week)
+    last_row = np.append(first_row[1:], len(date)) - 1
+
+    timeframe = key.iloc[first_row].reset_index(drop=True)
+    timeframe['first_date'] = date.date.values[first_row]
+    timeframe['last_date'] = date.date.values[last_row]
+    timeframe['first_row'] = first_row
+    timeframe['last_row'] = last_row
+    return date, timeframe
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def load_price_data(
+    path, columns=('code', 'name', 'date', 'price'), price_dtype='float32',
+    cache_path=None
+):
+    '''
+    path - long-format csv, e.g. finance_data.csv
+    columns, price_dtype - passed to read_price_csv
+    cache_path - binary cache of the parsed tables, None uses path + '.pkl', False disables it
+
+    Returns (data, date, timeframe) as used by the simulation notebook.
+    The first call parses the csv and writes the cache, later calls read the cache as long as
+    the csv (size and modification time), the columns and price_dtype are unchanged.
+    '''
+    if cache_path is None:
+        cache_path = path + '.pkl'
+    stamp = (CACHE_VERSION, _source_stamp(path), tuple(columns), str(price_dtype))
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                cached = pickle.load(file)
+            if cached['stamp'] == stamp:
+                return cached['data'], cached['date'], cached['timeframe']
+        except Exception:
+            # unreadable or written by an incompatible version, parse the csv again
+            pass
+
+    data = read_price_csv(path, columns, price_dtype)
+    date, timeframe = trading_calendar(data)
+    if cache_path:
+        with open(cache_path, 'wb') as file:
+            pickle.dump(
+                {'stamp': stamp, 'data': data, 'date': date, 'timeframe': timeframe},
+                file, protocol=pickle.HIGHEST_PROTOCOL
+            )
+    return data, date, timeframe
+
+
+def load_price(path, columns=('code', 'name', 'date', 'price'), price_dtype='float64', cache_path=None):
+    '''
+    path, columns, cache_path - passed to load_price_data
+    price_dtype - dtype of the prices, float64 as the notebook so the screen gives the same statistics
+
+    dates x codes price DataFrame of the csv, the input of screen_weeks, replay and WalkForward:
+        price = load_price('finance_data.csv')
+        trade_result = WalkForward('finance.checkpoint').run(price)
+    Parsed through the binary cache of load_price_data, so later runs skip the csv.
+    '''
+    data = load_price_data(path, columns, price_dtype, cache_path)[0]
+    code = data.code
+    if isinstance(code.dtype, pd.CategoricalDtype):
+        code = code.astype(str)
+    return pd.DataFrame({'date': data.date, 'code': code, 'price': data.price}).pivot(
+        index='date', columns='code', values='price'
+    )
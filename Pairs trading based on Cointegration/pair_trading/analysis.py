@@ -1,15 +1,19 @@
+from contextlib import nullcontext
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-plt.style.use('seaborn')
+# matplotlib 3.6 起seaborn樣式改名為seaborn-v0_8
+plt.style.use('seaborn-v0_8' if 'seaborn-v0_8' in plt.style.available else 'seaborn')
 
 class Analysis:
     '''
     strategy - 輸入欲分析的策略(策略物件中含有交易表格，送入Analysis物件進行分析)
+    profiler - 記錄各階段執行時間的Profiler，預設沿用strategy的profiler
     '''
     
-    def __init__(self, strategy):
+    def __init__(self, strategy, profiler=None):
         self.strategy = strategy
+        self.profiler = getattr(strategy, 'profiler', None) if profiler is None else profiler
         self.stock_to_buy_trade_table = self.strategy.stock_to_buy_trade_table
         self.stock_to_sellshort_trade_table = self.strategy.stock_to_sellshort_trade_table
     
@@ -21,95 +25,93 @@ class Analysis:
         elif buy_or_short == 'short':
             direction = -1
             trade_table = self.stock_to_sellshort_trade_table.reset_index(drop=True)
-        entry_exit_index = pd.DataFrame({
-            'entry': trade_table[trade_table.entry_exit_points*direction > 0].index,
-            'exit': trade_table[trade_table.entry_exit_points*direction < 0].index
-        }) 
+        entry_index = np.flatnonzero((trade_table.entry_exit_points*direction > 0).values)
+        exit_index = np.flatnonzero((trade_table.entry_exit_points*direction < 0).values)
 
-        # 紀錄交易結果相關資訊
-        trade_result = pd.DataFrame([])
-        for i in range(len(entry_exit_index)):
-            current_index = entry_exit_index.iloc[i]
-            temp_entry_index, temp_exit_index = current_index.entry, current_index.exit
-            temp_table = trade_table.iloc[temp_entry_index: temp_exit_index+1]
-            temp_table = temp_table.copy()
+        # 每筆交易為一個區段[entry, exit]，以下皆以陣列一次計算所有交易
+        # 紀錄進出場日期與持有時間
+        date = trade_table.date
+        entry_date = date.values[entry_index]
+        exit_date = date.values[exit_index]
+        holding_date = pd.Series(exit_date - entry_date).dt.days.values
 
-            # 紀錄進出場日期與持有時間
-            entry_date = temp_table.date.iloc[0]
-            exit_date = temp_table.date.iloc[-1]
-            holding_date = (exit_date - entry_date).days
+        # 記錄進出場價格及部位大小
+        # 第2個column為價格資料，因為可能是用其他價格進行交易例如：open, high等，因此用index的方式呼叫
+        price = trade_table.iloc[:, 1].values
+        entry_price = price[entry_index]
+        exit_price = price[exit_index]
+        position_size = trade_table.entry_exit_points.values[entry_index]
 
-            # 記錄進出場價格及部位大小
-            # 第2個column為價格資料，因為可能是用其他價格進行交易例如：open, high等，因此用index的方式呼叫
-            entry_price = temp_table.iloc[0, 1]
-            exit_price = temp_table.iloc[-1, 1]
-            position_size = temp_table.entry_exit_points.iloc[0]
+        # 找出MFE, MAE
+        # 扣掉進場時累加的報酬才能找出發生在當筆交易的損益狀況
+        # 區段最大最小值透過reduceat計算，區段邊界為[entry_0, exit_0+1, entry_1, exit_1+1, ...]
+        # 結尾補上一個值避免exit+1超出範圍，fmax/fmin與pandas相同略過na
+        cumulative_profit = trade_table.cumulative_profit.values
+        entry_profit = cumulative_profit[entry_index]
+        boundary = np.column_stack([entry_index, exit_index + 1]).ravel()
+        padded_profit = np.append(cumulative_profit, np.nan)
+        maximum_favorable_excursion = np.fmax.reduceat(padded_profit, boundary)[::2] - entry_profit
+        maximum_adverse_excursion = np.fmin.reduceat(padded_profit, boundary)[::2] - entry_profit
 
-            # 找出MFE, MAE
-            # 扣掉累加的報酬才能找出發生在當筆交易的損益狀況
-            temp_table['potential_profit'] = temp_table.cumulative_profit - temp_table.cumulative_profit.iloc[0]
-            maximum_favorable_excursion = temp_table['potential_profit'].max()
-            maximum_adverse_excursion = temp_table['potential_profit'].min()
+        # 紀錄報酬
+        entry_holdings = np.abs(trade_table.holdings.values[entry_index])
+        gross_profit = cumulative_profit[exit_index] - entry_profit
+        gross_return = gross_profit/entry_holdings
+        trade_cost = (
+            # 手續費(進出場接收)
+            entry_price * np.abs(position_size) * self.strategy.cost +
+            exit_price * np.abs(position_size) * self.strategy.cost +
+            # 交易稅(出場收)
+            exit_price * np.abs(position_size) * self.strategy.tax_rate
+            )
+        net_profit = gross_profit - trade_cost
+        net_return = net_profit/entry_holdings
 
-            # 紀錄報酬
-            gross_profit = temp_table['potential_profit'].iloc[-1]
-            gross_return = gross_profit/abs(temp_table.holdings.iloc[0])
-            trade_cost = (
-                # 手續費(進出場接收)
-                entry_price * abs(position_size) * self.strategy.cost +
-                exit_price * abs(position_size) * self.strategy.cost +
-                # 交易稅(出場收)
-                exit_price * abs(position_size) * self.strategy.tax_rate
-                )
-            net_profit = gross_profit - trade_cost
-            net_return = net_profit/abs(temp_table.holdings.iloc[0])
-
-            # 將資料整理成dataframe
-            temp_result = pd.DataFrame({
-                'entry_date': entry_date,
-                'exit_date': exit_date,
-                'holding_date': holding_date,
-                'position_size': position_size,
-                'entry_price': entry_price,
-                'exit_price': exit_price,
-                'gross_profit': gross_profit,
-                'gross_return': gross_return,
-                'trade_cost': trade_cost,
-                'net_profit': net_profit,
-                'net_return': net_return,
-                # 考量手續費後的MFE, MAE
-                'maximum_favorable_excursion': maximum_favorable_excursion - trade_cost,
-                'maximum_adverse_excursion': maximum_adverse_excursion - trade_cost
-            }, columns=[
-                # 需指定columns否則順序會跑掉
-                'entry_date',
-                'exit_date',
-                'holding_date',
-                'position_size',
-                'entry_price',
-                'exit_price',
-                'gross_profit',
-                'gross_return',
-                'trade_cost',
-                'net_profit',
-                'net_return',
-                'maximum_favorable_excursion',
-                'maximum_adverse_excursion'
-            ], index=[i])
-
-            # 合併dataframe
-            trade_result = pd.concat([trade_result, temp_result])
+        # 將資料整理成dataframe
+        trade_result = pd.DataFrame({
+            'entry_date': entry_date,
+            'exit_date': exit_date,
+            'holding_date': holding_date,
+            'position_size': position_size,
+            'entry_price': entry_price,
+            'exit_price': exit_price,
+            'gross_profit': gross_profit,
+            'gross_return': gross_return,
+            'trade_cost': trade_cost,
+            'net_profit': net_profit,
+            'net_return': net_return,
+            # 考量手續費後的MFE, MAE
+            'maximum_favorable_excursion': maximum_favorable_excursion - trade_cost,
+            'maximum_adverse_excursion': maximum_adverse_excursion - trade_cost
+        }, columns=[
+            # 需指定columns否則順序會跑掉
+            'entry_date',
+            'exit_date',
+            'holding_date',
+            'position_size',
+            'entry_price',
+            'exit_price',
+            'gross_profit',
+            'gross_return',
+            'trade_cost',
+            'net_profit',
+            'net_return',
+            'maximum_favorable_excursion',
+            'maximum_adverse_excursion'
+        ])
         return trade_result
     
     def run(self):
         '''
         執行分析
         '''
-        # 做多交易結果
-        self.stock_to_buy_trade_result = self.__parse_trade_result(buy_or_short='buy')
+        stage = nullcontext() if self.profiler is None else self.profiler.stage('Analysis parse trade result')
+        with stage:
+            # 做多交易結果
+            self.stock_to_buy_trade_result = self.__parse_trade_result(buy_or_short='buy')
 
-        # 做空交易結果
-        self.stock_to_sellshort_trade_result = self.__parse_trade_result(buy_or_short='short')
+            # 做空交易結果
+            self.stock_to_sellshort_trade_result = self.__parse_trade_result(buy_or_short='short')
         
         # 總結果(做多與做空為一個配對，只儲存以下分析需要用到的變數)
         total_trade_result = pd.DataFrame([])
@@ -270,4 +272,175 @@ class Analysis:
         plt.xlabel('Trade Number', size=15)
         plt.ylabel('NTD', size=15)
         plt.xticks(size=13)
-        plt.yticks(size=13);
\ No newline at end of file
+        plt.yticks(size=13);
+
+class PortfolioAnalysis:
+    '''
+    strategies - 已執行run的Strategy的list(或以配對名稱為key的dict)，或已執行run的BatchStrategy
+    pairs - 配對名稱，預設為dict的key、BatchStrategy的pairs或0, 1, 2...
+    initial_capital - 投資組合的初始資金
+    profiler - 記錄各階段執行時間的Profiler
+
+    將所有配對的損益合併為投資組合的每日結果(共用日期軸)，不需為每個配對建立DataFrame再對齊合併。
+    每個配對每日只記錄變動量(損益、持有部位價值、是否持有)，
+    透過一次scatter-add(bincount)加總到日期軸上，再以cumsum還原為每日的部位與權益，
+    配對某日沒有資料時沿用前一日的部位。交易成本與Analysis相同，於進出場當日扣除。
+    '''
+
+    def __init__(self, strategies, pairs=None, initial_capital=1000000, profiler=None):
+        if isinstance(strategies, dict):
+            pairs = list(strategies.keys()) if pairs is None else pairs
+            strategies = list(strategies.values())
+        self.strategies = strategies
+        self.initial_capital = initial_capital
+        self.profiler = profiler
+        if pairs is None:
+            pairs = strategies.pairs if hasattr(strategies, 'shape') else range(len(strategies))
+        self.pairs = list(pairs)
+
+    # 以下__開頭者為內部使用function
+    def __stage(self, name):
+        return nullcontext() if self.profiler is None else self.profiler.stage(name)
+
+    @staticmethod
+    def __leg_change(trade_table, price, direction, cost, tax_rate):
+        # 單邊(做多或放空)每個資料點的損益、部位價值變動與交易成本，na視為0
+        # 陣列可為(bars)或(bars x pairs)，皆沿第0軸差分
+        holdings = np.nan_to_num(np.asarray(trade_table['holdings'], dtype=float))
+        profit = np.nan_to_num(np.asarray(trade_table['cumulative_profit'], dtype=float))
+        points = np.nan_to_num(np.asarray(trade_table['entry_exit_points'], dtype=float))
+        price = np.nan_to_num(np.asarray(price, dtype=float))
+
+        # 手續費進出場皆收，交易稅只在出場收(與Analysis相同)
+        trade_value = np.abs(points)*price
+        trade_cost = trade_value*cost + np.where(points*direction < 0, trade_value*tax_rate, 0)
+        profit_change = np.diff(profit, axis=0, prepend=0) - trade_cost
+        holdings_change = np.diff(holdings, axis=0, prepend=0)
+        is_holding = holdings != 0
+        holding_change = np.diff(is_holding.astype(np.int8), axis=0, prepend=0)
+        trade_number = (points*direction > 0).sum(axis=0)
+        return profit_change, holdings_change, holding_change, trade_number
+
+    def __changes(self):
+        # 所有配對的(日期, 配對, 變動量)攤平成一維陣列
+        if hasattr(self.strategies, 'shape'):
+            # BatchStrategy，(bars x pairs)陣列已在同一個日期軸上
+            batch = self.strategies
+            legs = [
+                self.__leg_change(
+                    table, table[batch.trade_on + '_price'], direction, batch.cost, batch.tax_rate
+                )
+                for table, direction in [
+                    (batch.stock_to_buy_trade_table, 1), (batch.stock_to_sellshort_trade_table, -1)
+                ]
+            ]
+            date = np.repeat(batch.date, batch.shape[1])
+            pair = np.tile(np.arange(batch.shape[1]), batch.shape[0])
+            changes = [[leg[k].ravel() for k in range(3)] for leg in legs]
+            trade_number = legs[0][3].sum()
+            return date, pair, changes, trade_number
+
+        dates, pairs, changes, trade_number = [], [], [[[], [], []], [[], [], []]], 0
+        for i, strategy in enumerate(self.strategies):
+            tables = [(strategy.stock_to_buy_trade_table, 1), (strategy.stock_to_sellshort_trade_table, -1)]
+            for leg, (table, direction) in enumerate(tables):
+                # 第2個column為價格資料(同Analysis)
+                leg_change = self.__leg_change(
+                    table, table.iloc[:, 1].values, direction, strategy.cost, strategy.tax_rate
+                )
+                for k in range(3):
+                    changes[leg][k].append(leg_change[k])
+            trade_number += leg_change[3]
+            dates.append(table.date.values)
+            pairs.append(np.full(len(table), i))
+        if len(dates) == 0:
+            return np.array([], dtype='datetime64[ns]'), np.array([], dtype=int), [[np.array([])]*3]*2, 0
+        changes = [[np.concatenate(values) for values in leg] for leg in changes]
+        return np.concatenate(dates), np.concatenate(pairs), changes, trade_number
+
+    def run(self):
+        '''
+        執行分析，結果存於daily(每日投資組合)與pair_profit(各配對淨損益)
+        '''
+        with self.__stage('PortfolioAnalysis collect'):
+            date, pair, (buy, short), self.trade_number = self.__changes()
+
+        with self.__stage('PortfolioAnalysis scatter'):
+            # 共用日期軸，一次scatter-add所有配對的變動量
+            date_axis, date_index = np.unique(date, return_inverse=True)
+            days = len(date_axis)
+
+            def scatter(weights):
+                return np.bincount(date_index, weights=weights, minlength=days)
+
+            profit_and_loss = scatter(buy[0]) + scatter(short[0])
+            long_holdings = np.cumsum(scatter(buy[1]))
+            short_holdings = np.cumsum(scatter(short[1]))
+            # 兩檔股票同時進出場，以做多的一邊判斷配對是否持有
+            position_num = np.rint(np.cumsum(scatter(buy[2]))).astype(int)
+            # 配對名稱可能為tuple，不展開成MultiIndex
+            self.pair_profit = pd.Series(
+                np.bincount(pair, weights=buy[0] + short[0], minlength=len(self.pairs)),
+                index=pd.Index(self.pairs, tupleize_cols=False)
+            )
+
+        # 權益為初始資金加上累積損益，現金為權益扣掉部位價值(放空部位價值為負)
+        equity = self.initial_capital + np.cumsum(profit_and_loss)
+        net_exposure = long_holdings + short_holdings
+        self.daily = pd.DataFrame({
+            'profit_and_loss': profit_and_loss,
+            'equity': equity,
+            'cash': equity - net_exposure,
+            'long_holdings': long_holdings,
+            'short_holdings': short_holdings,
+            'gross_exposure': long_holdings - short_holdings,
+            'net_exposure': net_exposure,
+            'position_num': position_num,
+            'drawdown': np.maximum.accumulate(equity) - equity
+        }, index=pd.Index(date_axis, name='date'))
+
+    def summary(self):
+        '''
+        投資組合的總結(欄位名稱與Analysis.summary相同者意義相同，但回撤以每日權益計算)
+        '''
+        daily = self.daily
+        summary = pd.DataFrame({
+            'total_profit': daily.profit_and_loss.sum(),
+            'max_drowdown': daily.drawdown.max(),
+            'max_position_num': daily.position_num.max(),
+            'average_position_num': daily.position_num.mean(),
+            'max_gross_exposure': daily.gross_exposure.max(),
+            # 有持有部位的天數比例
+            'exposure_rate': (daily.position_num > 0).mean(),
+            'total_trade_number': self.trade_number
+        }, columns=[
+            'total_profit',
+            'max_drowdown',
+            'max_position_num',
+            'average_position_num',
+            'max_gross_exposure',
+            'exposure_rate',
+            'total_trade_number'
+        ], index=[0])
+
+        summary = summary.apply(lambda x: round(x, 4))
+        return summary
+
+    def plot_equity_curve(self, figsize=(16, 8)):
+        '''
+        每日權益曲線與同時持有的配對數
+        '''
+        figure, (equity_axis, position_axis) = plt.subplots(
+            2, 1, figsize=figsize, sharex=True, gridspec_kw={'height_ratios': [3, 1]}
+        )
+        equity_axis.plot(self.daily.equity, c='black')
+        equity_axis.fill_between(
+            self.daily.index, self.daily.equity, self.daily.equity + self.daily.drawdown,
+            color='green', alpha=0.2, label='Drawdown'
+        )
+        equity_axis.set_title('Portfolio Equity Curve', size=20)
+        equity_axis.set_ylabel('NTD', size=15)
+        equity_axis.legend(fontsize=13)
+        position_axis.step(self.daily.index, self.daily.position_num, c='black', where='post')
+        position_axis.set_ylabel('Positions', size=15)
+        position_axis.set_xlabel('Date', size=15);
@@ -1,25 +1,59 @@
+import numpy as np
+import pandas as pd
+from .expression import Expression
+
 def lag(series, periods=1):
     '''
     將序列值落後一期
+    也可輸入numpy陣列，二維陣列為(bars x symbols)，每個symbol各自落後
+    輸入Expression時回傳惰性運算式(見expression)，常數落後後不變
     '''
+    if isinstance(series, Expression):
+        return series.apply(lag, periods=periods)
+    if np.ndim(series) == 0:
+        return series
+    if isinstance(series, np.ndarray):
+        series = series.astype(float)
+        result = np.full(series.shape, np.nan)
+        if periods == 0:
+            result[:] = series
+        elif periods > 0:
+            result[periods:] = series[:-periods]
+        else:
+            result[:periods] = series[-periods:]
+        return result
     return series.shift(periods=periods)
 
+def _rolling(series, window, how):
+    # numpy陣列轉為DataFrame後逐欄計算，結果維持原本形狀
+    if isinstance(series, np.ndarray):
+        frame = pd.DataFrame(series.astype(float).reshape(len(series), -1))
+        return getattr(frame.rolling(window=window), how)().values.reshape(series.shape)
+    return getattr(series.rolling(window=window), how)()
+
 def maximum(series, window=5):
     '''
     回傳輸入序列中給定窗格下的最大值
+    也可輸入numpy陣列，二維陣列為(bars x symbols)，輸入Expression時回傳惰性運算式
     '''
-    return series.rolling(window=window).max()
+    if isinstance(series, Expression):
+        return series.apply(maximum, window=window)
+    return _rolling(series, window, 'max')
 
 def minimum(series, window=5):
     '''
     回傳輸入序列中給定窗格下的最小值
+    也可輸入numpy陣列，二維陣列為(bars x symbols)，輸入Expression時回傳惰性運算式
     '''
-    return series.rolling(window=window).min()
+    if isinstance(series, Expression):
+        return series.apply(minimum, window=window)
+    return _rolling(series, window, 'min')
 
 def crossover(series_1, series_2):
     '''
-    回傳符合序列一黃金交叉序列二的值
+    回傳符合序列一黃金交叉序列二的值(序列二可為常數)
     (序列一的t-1期值小於序列二的t-1期值，且序列一t期值大於序列二t期值)
+    也可輸入numpy陣列，二維陣列為(bars x symbols)，輸入Expression時回傳惰性運算式
     '''
     past = lag(series_1, periods=1) < lag(series_2, periods=1)
     now = series_1 > series_2
@@ -27,26 +61,157 @@ def crossover(series_1, series_2):
 
 def crossunder(series_1, series_2):
     '''
-    回傳符合序列一死亡交叉序列二的值
+    回傳符合序列一死亡交叉序列二的值(序列二可為常數)
     (序列一的t-1期值大於序列二的t-1期值，且序列一t期值小於序列二t期值)
+    也可輸入numpy陣列，二維陣列為(bars x symbols)，輸入Expression時回傳惰性運算式
     '''
     past = lag(series_1, periods=1) > lag(series_2, periods=1)
     now = series_1 < series_2
     return past & now
 
+def _common_rows(stock_1, stock_2):
+    # 兩檔股票皆無缺值且日期相同的列位置，結果與dropna, merge, isin相同但不產生中間的DataFrame
+    complete_1 = stock_1.notna().values.all(axis=1)
+    complete_2 = stock_2.notna().values.all(axis=1)
+    dates_1, dates_2 = stock_1.date.values, stock_2.date.values
+    if complete_1.all() and complete_2.all() and len(dates_1) == len(dates_2) and (dates_1 == dates_2).all():
+        # 已對齊(同一張股價表取出的配對)時直接使用全部的列
+        return np.arange(len(dates_1)), np.arange(len(dates_2))
+    rows_1 = np.flatnonzero(complete_1 & stock_1.date.isin(dates_2[complete_2]).values)
+    rows_2 = np.flatnonzero(complete_2 & stock_2.date.isin(dates_1[complete_1]).values)
+    return rows_1, rows_2
+
+def _select_rows(stock, rows):
+    # 全部或連續的列以切片取出(copy-on-write下不複製)，其餘依位置取出
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        stock = stock.iloc[rows[0]: rows[-1] + 1]
+    else:
+        stock = stock.iloc[rows]
+    stock = stock.reset_index(drop=True)
+    if not stock.date.is_monotonic_increasing:
+        stock = stock.sort_values(by='date')
+    return stock
+
 def preprocess(stock_1, stock_2):
     '''
     依據日期之交集回傳股價資料
+    只計算列的位置，已對齊的配對直接回傳輸入資料的切片
+    '''
+    rows_1, rows_2 = _common_rows(stock_1, stock_2)
+    return _select_rows(stock_1, rows_1), _select_rows(stock_2, rows_2)
+
+# 以下為逐筆更新的版本，每次輸入一個bar的值(單一數值或多個symbol的一維陣列)，
+# 回傳與上方函數在該bar相同的結果，不需重算整段歷史
+
+class _Stream:
+    # 記錄輸入為單一數值或陣列，輸出維持相同形式
+    def _to_array(self, value):
+        value = np.asarray(value, dtype=float)
+        self.is_scalar = value.ndim == 0
+        return np.atleast_1d(value)
+
+    def _to_output(self, result):
+        return result[0] if self.is_scalar else result
+
+class Lag(_Stream):
+    '''
+    逐筆版本的lag，以環狀陣列保存最近periods個值
+    periods - 落後期數(>=1)
+    '''
+    def __init__(self, periods=1):
+        if periods < 1:
+            raise ValueError('periods must be >= 1')
+        self.periods = periods
+        self.bar = 0
+        self.buffer = None
+
+    def update(self, value):
+        value = self._to_array(value)
+        if self.buffer is None:
+            self.buffer = np.full((self.periods, len(value)), np.nan)
+        position = self.bar % self.periods
+        result = self.buffer[position].copy()
+        self.buffer[position] = value
+        self.bar += 1
+        return self._to_output(result)
+
+class _Extreme(_Stream):
+    # van Herk/Gil-Werman：bar依window切成塊，窗格 = 前一塊的後綴 + 目前這塊的前綴，
+    # 目前這塊只累積前綴極值，一塊結束時一次算出它的後綴極值供下一塊使用，
+    # 每個值只進出一次，所有symbol一起計算，每個bar平均為O(1)
+    # np.maximum(np.minimum)遇到nan即為nan，與rolling相同窗格內有na則為na
+    def __init__(self, window, extreme):
+        if window < 1:
+            raise ValueError('window must be >= 1')
+        self.window = window
+        self.extreme = extreme
+        self.bar = 0
+        self.block = None
+        self.suffix = None
+        self.prefix = None
+
+    def update(self, value):
+        value = self._to_array(value)
+        if self.block is None:
+            self.block = np.full((self.window, len(value)), np.nan)
+            # 第一塊之前沒有值，未滿window個bar前為na
+            self.suffix = np.full((self.window, len(value)), np.nan)
+        position = self.bar % self.window
+        self.block[position] = value
+        self.prefix = value if position == 0 else self.extreme(self.prefix, value)
+        if position == self.window - 1:
+            # 窗格正好是這一塊
+            result = self.prefix
+            self.suffix = self.extreme.accumulate(self.block[::-1], axis=0)[::-1]
+        else:
+            result = self.extreme(self.suffix[position + 1], self.prefix)
+        self.bar += 1
+        return self._to_output(result)
+
+class Maximum(_Extreme):
+    '''
+    逐筆版本的maximum
+    window - 窗格大小(>=1)
+    '''
+    def __init__(self, window=5):
+        super().__init__(window, np.maximum)
+
+class Minimum(_Extreme):
+    '''
+    逐筆版本的minimum
+    window - 窗格大小(>=1)
+    '''
+    def __init__(self, window=5):
+        super().__init__(window, np.minimum)
+
+class _Cross(_Stream):
+    # 只需保存兩序列前一期的值
+    def __init__(self):
+        self.previous_1 = None
+        self.previous_2 = None
+
+    def update(self, value_1, value_2):
+        value_1 = self._to_array(value_1)
+        value_2 = self._to_array(value_2)
+        if self.previous_1 is None:
+            self.previous_1 = np.full(len(value_1), np.nan)
+            self.previous_2 = np.full(len(value_2), np.nan)
+        result = self._is_cross(self.previous_1, self.previous_2, value_1, value_2)
+        self.previous_1, self.previous_2 = value_1, value_2
+        return self._to_output(result)
+
+class Crossover(_Cross):
+    '''
+    逐筆版本的crossover，update輸入序列一及序列二在該bar的值
+    '''
+    @staticmethod
+    def _is_cross(past_1, past_2, now_1, now_2):
+        return (past_1 < past_2) & (now_1 > now_2)
+
+class Crossunder(_Cross):
+    '''
+    逐筆版本的crossunder，update輸入序列一及序列二在該bar的值
     '''
-    stock_1 = stock_1.copy()
-    stock_2 = stock_2.copy()
-    stock_1.dropna(inplace=True)
-    stock_2.dropna(inplace=True)
-    date_index = stock_1.merge(stock_2, on='date')['date']
-    stock_1 = stock_1[stock_1.date.isin(date_index)]
-    stock_1.reset_index(inplace=True, drop=True)
-    stock_1.sort_values(by='date', inplace=True)
-    stock_2 = stock_2[stock_2.date.isin(date_index)]
-    stock_2.reset_index(inplace=True, drop=True)
-    stock_2.sort_values(by='date', inplace=True)
-    return stock_1, stock_2
\ No newline at end of file
+    @staticmethod
+    def _is_cross(past_1, past_2, now_1, now_2):
+        return (past_1 > past_2) & (now_1 < now_2)
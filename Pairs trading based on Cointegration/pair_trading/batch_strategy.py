@@ -0,0 +1,189 @@
+import pandas as pd
+import numpy as np
+from .expression import Expression, Evaluator, all_of
+
+
+class BatchStrategy:
+    '''
+    一次回測多個配對，參數與Strategy相同
+    next_bar - 訊號出現後何時進出場，0為出現後馬上執行交易，1為下一個價格執行交易，2...以此類推
+    trade_on - 交易價格的名稱(只用於輸出欄位名稱，價格由run直接輸入)
+    initial_capital - 初始資金(每個配對各自計算)
+    tax_rate - 交易稅
+    cost - 交易成本(率)
+    '''
+
+    def __init__(
+        self, next_bar=1, trade_on='close',
+        initial_capital=1000000, tax_rate=0.003, cost=0.001425
+    ):
+        self.next_bar = next_bar
+        self.trade_on = trade_on
+        self.initial_capital = initial_capital
+        self.tax_rate = tax_rate
+        self.cost = cost
+
+    # 以下__開頭者為內部使用function
+    def __generate_signal(self, condition_list):
+        # 與Strategy相同，回傳所有條件的交集，每個條件為(bars x pairs)的布林陣列
+        if isinstance(condition_list, Expression) or (
+            isinstance(condition_list, np.ndarray) and condition_list.ndim == 2
+        ):
+            condition_list = [condition_list]
+        # 含有惰性運算式時合併為一個運算式計算
+        if any(isinstance(condition, Expression) for condition in condition_list):
+            condition_list = [self.evaluator.evaluate(all_of(*condition_list))]
+        signal = np.ones(self.shape, dtype=bool)
+        for condition in condition_list:
+            signal = signal & np.asarray(condition, dtype=bool)
+        return signal
+
+    def __generate_state(self):
+        # 只有進場訊號為1，只有出場訊號為-1，同時出現或都沒有為0
+        event = self.condition_in.astype(int) - self.condition_out.astype(int)
+
+        # 持有部位若且唯若最近一個非0訊號為進場(一開始視為空手)
+        # 透過累積最大值找出每個時點最近一個非0訊號的位置
+        bar = np.arange(self.shape[0])[:, None]
+        last_event_bar = np.maximum.accumulate(np.where(event != 0, bar, 0), axis=0)
+        last_event = np.take_along_axis(event, last_event_bar, axis=0)
+        return last_event == 1
+
+    def __define_position_size(self, is_holding):
+        # 進場點位(訊號出現時由空手變為持有)
+        previous_is_holding = np.vstack([np.zeros((1, self.shape[1]), dtype=bool), is_holding[:-1]])
+        is_entry = is_holding & ~previous_is_holding
+
+        if isinstance(self.hedge_ratio, str) and self.hedge_ratio == 'auto':
+            # 使價格較高者部位為1，價格較低者部位則由高價除以低價並四捨五入
+            buy_is_higher = self.stock_to_buy >= self.stock_to_sellshort
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stock_to_buy_size = np.where(
+                    buy_is_higher, 1, np.round(self.stock_to_sellshort/self.stock_to_buy)
+                )
+                stock_to_sellshort_size = np.where(
+                    buy_is_higher, np.round(self.stock_to_buy/self.stock_to_sellshort), 1
+                )
+        else:
+            # list如[2, 1]套用到所有配對，(pairs x 2)陣列則每個配對各自設定
+            hedge_ratio = np.asarray(self.hedge_ratio, dtype=float).reshape(-1, 2)
+            stock_to_buy_size = np.broadcast_to(hedge_ratio[:, 0], self.shape)
+            stock_to_sellshort_size = np.broadcast_to(hedge_ratio[:, 1], self.shape)
+
+        # 部位只由進場決定，持有期間(含出場)沿用進場時的部位
+        bar = np.arange(self.shape[0])[:, None]
+        entry_bar = np.maximum.accumulate(np.where(is_entry, bar, 0), axis=0)
+        stock_to_buy_size = np.take_along_axis(stock_to_buy_size, entry_bar, axis=0)
+        stock_to_sellshort_size = np.take_along_axis(stock_to_sellshort_size, entry_bar, axis=0)
+
+        # 以張為單位因此乘1000
+        return stock_to_buy_size * 1000, stock_to_sellshort_size * 1000
+
+    def __shift(self, positions):
+        # 與Strategy相同，透過shift決定出實際部位持有時間點，並於最後一期強制平倉
+        positions = positions.astype(float)
+        if self.next_bar > 0:
+            positions = np.vstack([
+                np.full((min(self.next_bar, self.shape[0]), self.shape[1]), np.nan),
+                positions[:-self.next_bar]
+            ])
+        positions[-1] = 0
+        return positions
+
+    def __generate_trade_table(self, position, stock_price):
+        # 持有部位價值
+        holdings = position * stock_price
+
+        # 進出場點位
+        entry_exit_points = np.vstack([np.full((1, self.shape[1]), np.nan), np.diff(position, axis=0)])
+
+        # 現金部位，cumsum與pandas相同略過na
+        flow = entry_exit_points * stock_price
+        cumulative_flow = np.nancumsum(flow, axis=0)
+        cumulative_flow[np.isnan(flow)] = np.nan
+        cash = self.initial_capital - cumulative_flow
+
+        total_value = cash + holdings
+        cumulative_profit = total_value - self.initial_capital
+        return {
+            self.trade_on + '_price': stock_price,
+            'holdings': holdings,
+            'entry_exit_points': entry_exit_points,
+            'cash': cash,
+            'total_value': total_value,
+            'cumulative_profit': cumulative_profit
+        }
+
+    def run(
+        self, stock_to_buy, stock_to_sellshort,
+        condition_in, condition_out,
+        hedge_ratio='auto', date=None, pairs=None, evaluator=None
+    ):
+        '''
+        stock_to_buy - condition_in成立時欲做多的股票價格(trade_on)，(bars x pairs)陣列
+        stock_to_sellshort - condition_in成立時欲放空的股票價格(trade_on)，(bars x pairs)陣列
+        condition_in - 進場訊號，(bars x pairs)布林陣列或其list
+        condition_out - 出場訊號，(bars x pairs)布林陣列或其list
+        hedge_ratio - 對沖比率，預設為auto(規則同Strategy)，
+                      也可以輸入list如：[2, 1]套用到所有配對，或(pairs x 2)陣列分別設定
+        date - 長度為bars的日期，輸出表格使用，預設為0, 1, 2...
+        pairs - 長度為pairs的配對名稱，輸出表格使用，預設為0, 1, 2...
+        evaluator - 條件為惰性運算式(見expression)時用來計算的Evaluator，輸入序列為(bars x pairs)陣列
+        '''
+        self.stock_to_buy = np.asarray(stock_to_buy, dtype=float)
+        self.stock_to_sellshort = np.asarray(stock_to_sellshort, dtype=float)
+        self.shape = self.stock_to_buy.shape
+        self.hedge_ratio = hedge_ratio
+        self.date = np.arange(self.shape[0]) if date is None else np.asarray(date)
+        self.pairs = np.arange(self.shape[1]) if pairs is None else list(pairs)
+        self.evaluator = Evaluator() if evaluator is None else evaluator
+
+        # 建立訊號
+        self.condition_in = self.__generate_signal(condition_in)
+        self.condition_out = self.__generate_signal(condition_out)
+
+        # 建立部位(做多為正，放空為負)
+        is_holding = self.__generate_state()
+        stock_to_buy_size, stock_to_sellshort_size = self.__define_position_size(is_holding)
+        self.stock_to_buy_position = self.__shift(np.where(is_holding, stock_to_buy_size, 0))
+        self.stock_to_sellshort_position = self.__shift(np.where(is_holding, -stock_to_sellshort_size, 0))
+
+        # 儲存結果，每個欄位為(bars x pairs)陣列
+        self.stock_to_buy_trade_table = self.__generate_trade_table(
+            self.stock_to_buy_position, self.stock_to_buy
+        )
+        self.stock_to_sellshort_trade_table = self.__generate_trade_table(
+            self.stock_to_sellshort_position, self.stock_to_sellshort
+        )
+
+    def trade_table(self, buy_or_short='buy', wide=False):
+        '''
+        buy - 做多股票的交易表格
+        short - 放空股票的交易表格
+        wide - False回傳長表格(date, pair與Strategy交易表格的欄位)，
+               True回傳以(欄位, 配對)為欄的寬表格
+        '''
+        if buy_or_short == 'buy':
+            trade_table = self.stock_to_buy_trade_table
+        elif buy_or_short == 'short':
+            trade_table = self.stock_to_sellshort_trade_table
+        else:
+            raise Exception('Wrong input of buy_or_short!')
+
+        if wide:
+            return pd.concat({
+                column: pd.DataFrame(values, index=self.date, columns=self.pairs)
+                for column, values in trade_table.items()
+            }, axis=1)
+
+        # 配對名稱可能為tuple，逐一放入object陣列避免被展開成二維
+        pairs = np.empty(self.shape[1], dtype=object)
+        for i, pair in enumerate(self.pairs):
+            pairs[i] = pair
+        long_table = pd.DataFrame({
+            'date': np.repeat(self.date, self.shape[1]),
+            'pair': np.tile(pairs, self.shape[0])
+        })
+        for column, values in trade_table.items():
+            long_table[column] = values.ravel()
+        return long_table
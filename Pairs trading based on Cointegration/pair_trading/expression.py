@@ -0,0 +1,236 @@
+import operator
+import weakref
+import numpy as np
+import pandas as pd
+
+# 惰性運算式：basic_tool的lag, maximum, minimum, crossover等函數與比較、邏輯、四則運算
+# 遇到Expression時不立即計算，而是建立運算圖(DAG)，由Evaluator計算
+# 相同的運算(同一函數、參數與輸入節點)只會建立一個節點，因此不同條件共用的子運算式
+# (例如多個條件都用到的lag(spread))在計算時只算一次
+#
+#     spread = source('spread')
+#     conditions = [crossover(spread, upper) & (spread < maximum(spread, window))
+#                   for upper, window in ...]
+#     evaluator = Evaluator(spread=spread_of_the_pair)
+#     for condition_in in conditions:
+#         Strategy().run(stock_1, stock_2, [condition_in], [condition_out], evaluator=evaluator)
+
+# 相同key的節點只保留一個，節點不再被使用時自動移除
+_nodes = weakref.WeakValueDictionary()
+
+
+class Expression:
+    '''
+    運算圖的節點，由source, as_expression, all_of或運算子建立，不直接建立
+    function - 計算此節點的函數(葉節點為None)
+    arguments - 輸入節點
+    parameters - 函數的其他參數(排序後的(名稱, 值))
+    '''
+    __slots__ = ('function', 'arguments', 'parameters', 'kind', 'value', '__weakref__')
+
+    # 讓numpy陣列與pandas物件在運算時交給Expression處理
+    __array_ufunc__ = None
+    __pandas_priority__ = 5000
+
+    def apply(self, function, *arguments, **parameters):
+        '''
+        以function(本節點的值, *arguments的值, **parameters)建立新節點
+        '''
+        return _node(function, (self,) + arguments, parameters)
+
+    def __bool__(self):
+        raise Exception('Expression has no truth value, use & | ~ instead of and, or, not!')
+
+    def __repr__(self):
+        if self.function is None:
+            return '{}({!r})'.format(self.kind, self.value if self.kind != 'data' else type(self.value).__name__)
+        parameters = ''.join(', {}={!r}'.format(name, value) for name, value in self.parameters)
+        return '{}({}{})'.format(
+            getattr(self.function, '__name__', self.function),
+            ', '.join(repr(argument) for argument in self.arguments), parameters
+        )
+
+    def __lt__(self, other):
+        return _node(operator.lt, (self, other))
+
+    def __le__(self, other):
+        return _node(operator.le, (self, other))
+
+    def __gt__(self, other):
+        return _node(operator.gt, (self, other))
+
+    def __ge__(self, other):
+        return _node(operator.ge, (self, other))
+
+    def __eq__(self, other):
+        return _node(operator.eq, (self, other))
+
+    def __ne__(self, other):
+        return _node(operator.ne, (self, other))
+
+    # 定義__eq__後需指定__hash__：節點以物件本身為準(hash-consing依id)，可作為dict與set的key
+    __hash__ = object.__hash__
+
+    def __and__(self, other):
+        return all_of(self, other)
+
+    def __rand__(self, other):
+        return all_of(other, self)
+
+    def __or__(self, other):
+        return _node(operator.or_, (self, other))
+
+    def __ror__(self, other):
+        return _node(operator.or_, (other, self))
+
+    def __invert__(self):
+        return _node(operator.invert, (self,))
+
+    def __add__(self, other):
+        return _node(operator.add, (self, other))
+
+    def __radd__(self, other):
+        return _node(operator.add, (other, self))
+
+    def __sub__(self, other):
+        return _node(operator.sub, (self, other))
+
+    def __rsub__(self, other):
+        return _node(operator.sub, (other, self))
+
+    def __mul__(self, other):
+        return _node(operator.mul, (self, other))
+
+    def __rmul__(self, other):
+        return _node(operator.mul, (other, self))
+
+    def __truediv__(self, other):
+        return _node(operator.truediv, (self, other))
+
+    def __rtruediv__(self, other):
+        return _node(operator.truediv, (other, self))
+
+    def __neg__(self):
+        return _node(operator.neg, (self,))
+
+
+# 交換律成立的運算，輸入節點排序後相同的運算式即為同一節點
+_COMMUTATIVE = {operator.eq, operator.ne, operator.or_, operator.add, operator.mul}
+
+
+def _leaf(kind, value, key):
+    node = _nodes.get(key)
+    if node is None:
+        node = Expression()
+        node.function, node.arguments, node.parameters = None, (), ()
+        node.kind, node.value = kind, value
+        _nodes[key] = node
+    return node
+
+
+def _node(function, arguments, parameters=None):
+    arguments = tuple(as_expression(argument) for argument in arguments)
+    if function in _COMMUTATIVE:
+        arguments = tuple(sorted(arguments, key=id))
+    parameters = tuple(sorted((parameters or {}).items()))
+    # 輸入節點被此節點引用，存活期間id不會重複
+    key = (function, parameters, tuple(id(argument) for argument in arguments))
+    node = _nodes.get(key)
+    if node is None:
+        node = Expression()
+        node.function, node.arguments, node.parameters = function, arguments, parameters
+        node.kind, node.value = 'node', None
+        _nodes[key] = node
+    return node
+
+
+def source(name):
+    '''
+    名為name的輸入序列，計算時由Evaluator(name=序列)給定
+    '''
+    return _leaf('source', name, ('source', name))
+
+
+def as_expression(value):
+    '''
+    將數值、numpy陣列或pandas序列包裝為運算式(已是運算式則直接回傳)
+    陣列與序列以物件本身為準，同一物件為同一節點
+    '''
+    if isinstance(value, Expression):
+        return value
+    if np.ndim(value) == 0:
+        return _leaf('constant', value, ('constant', type(value), value))
+    return _leaf('data', value, ('data', id(value)))
+
+
+def _all(*conditions):
+    # 所有條件的交集，直接在同一個布林陣列上計算
+    signal = np.ones(np.broadcast_shapes(*[np.shape(condition) for condition in conditions]), dtype=bool)
+    for condition in conditions:
+        np.logical_and(signal, condition, out=signal)
+    return signal
+
+
+def all_of(*conditions):
+    '''
+    所有條件的交集(同&)，巢狀的交集會攤平並去除重複條件，計算時只產生一個布林陣列
+    '''
+    arguments = []
+    for condition in conditions:
+        condition = as_expression(condition)
+        arguments += condition.arguments if condition.function is _all else [condition]
+    arguments = sorted(set(arguments), key=id)
+    if len(arguments) == 1:
+        return arguments[0]
+    return _node(_all, arguments)
+
+
+def _to_array(value):
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return value.values
+    return np.asarray(value)
+
+
+class Evaluator:
+    '''
+    inputs - 輸入序列，名稱對應source(名稱)，可為pandas序列、一維或(bars x symbols)二維numpy陣列
+
+    計算運算式，所有計算過的節點都會保留，同一個Evaluator計算多個條件時共用的子運算式只算一次
+    換一組輸入序列(例如換一個配對)時建立新的Evaluator
+    '''
+
+    def __init__(self, **inputs):
+        self.inputs = {name: _to_array(value) for name, value in inputs.items()}
+        self.cache = {}
+
+    def evaluate(self, expression):
+        '''
+        回傳運算式的值(numpy陣列)，輸入list則回傳各運算式的值
+        '''
+        if isinstance(expression, (list, tuple)):
+            return [self.evaluate(item) for item in expression]
+        expression = as_expression(expression)
+        if expression in self.cache:
+            return self.cache[expression]
+
+        if expression.kind == 'source':
+            if expression.value not in self.inputs:
+                raise Exception('Missing input of source {!r}!'.format(expression.value))
+            value = self.inputs[expression.value]
+        elif expression.kind == 'constant':
+            value = expression.value
+        elif expression.kind == 'data':
+            value = _to_array(expression.value)
+        else:
+            value = expression.function(
+                *[self.evaluate(argument) for argument in expression.arguments],
+                **dict(expression.parameters)
+            )
+        self.cache[expression] = value
+        return value
+
+    def clear(self):
+        '''
+        清除保留的計算結果
+        '''
+        self.cache.clear()
@@ -1,4 +1,7 @@
+from contextlib import nullcontext
 import pandas as pd
+import numpy as np
+from .expression import Expression, Evaluator, all_of
 
 
 class Strategy:
@@ -8,20 +11,33 @@ class Strategy:
     initial_capital - 初始資金(後續分析中沒有使用到)
     tax_rate - 交易稅
     cost - 交易成本(率)
+    profiler - 記錄各階段執行時間的Profiler，預設不記錄
     '''
     
     def __init__(
         self, next_bar=1, trade_on='close',
-        initial_capital = 1000000, tax_rate=0.003, cost=0.001425
+        initial_capital = 1000000, tax_rate=0.003, cost=0.001425,
+        profiler=None
     ):
         self.next_bar = next_bar
         self.trade_on = trade_on
         self.initial_capital = initial_capital
         self.tax_rate = tax_rate
         self.cost = cost
+        self.profiler = profiler
     
     # 以下__開頭者為內部使用function
+    def __stage(self, name):
+        # 沒有profiler時不計時
+        return nullcontext() if self.profiler is None else self.profiler.stage(name)
+
     def __generate_signal(self, condition_list):
+        # 含有惰性運算式時，所有條件合併為一個運算式，計算後直接得到交集的布林陣列
+        if isinstance(condition_list, Expression):
+            condition_list = [condition_list]
+        if any(isinstance(condition, Expression) for condition in condition_list):
+            return pd.Series(self.evaluator.evaluate(all_of(*condition_list)))
+
         signal = pd.Series([True] * len(condition_list[0]))
 
         # 回傳所有條件的交集(這裡只處理"且")
@@ -35,42 +51,33 @@ class Strategy:
 
         # 產生內部函數處理對沖比率
         def __define_position_size():
-            # 依據信號出現時的index建立空的position_size
-            position_size = pd.DataFrame(
-                0,
-                index=self.__position_index,
-                columns=['stock_to_buy_position_size', 'stock_to_sellshort_position_size']
-            )
+            # 依據信號出現時的index取出兩檔股票的價格
+            current_stock_to_buy = self.stock_to_buy[self.trade_on].loc[self.__position_index].values
+            current_stock_to_sellshort = self.stock_to_sellshort[self.trade_on].loc[self.__position_index].values
 
             # 決定對沖比率
-            for i in self.__position_index:
-                current_stock_to_buy = self.stock_to_buy[self.trade_on][i]
-                current_stock_to_sellshort = self.stock_to_sellshort[self.trade_on][i]
-                # 使價格較高者部位為1，價格較低者部位則由高價除以低價並四捨五入
-                if current_stock_to_buy >= current_stock_to_sellshort:
-                    position_size.stock_to_buy_position_size[i] = 1
-                    position_size.stock_to_sellshort_position_size[i] = round(
-                        current_stock_to_buy/current_stock_to_sellshort
-                    )
-                else:
-                    position_size.stock_to_buy_position_size[i] = round(
-                        current_stock_to_sellshort/current_stock_to_buy
-                    )
-                    position_size.stock_to_sellshort_position_size[i] = 1
-            
+            # 使價格較高者部位為1，價格較低者部位則由高價除以低價並四捨五入(np.round與round同為四捨六入五成雙)
+            buy_is_higher = current_stock_to_buy >= current_stock_to_sellshort
+            stock_to_buy_position_size = np.where(
+                buy_is_higher, 1, np.round(current_stock_to_sellshort/current_stock_to_buy)
+            ).astype(int)
+            stock_to_sellshort_position_size = np.where(
+                buy_is_higher, np.round(current_stock_to_buy/current_stock_to_sellshort), 1
+            ).astype(int)
+
             # 上述作法同時考量進出場，但部位應只由進場決定
             # 部位為兩兩一組，前者為進場後者為出場，因此將後者的值改為前者
-            for i in range(len(position_size)):
-                # 使用try以避免index out of range
-                try:
-                    position_size.iloc[2*i + 1] = position_size.iloc[2*i]
-                except:
-                    pass
+            # (若最後一筆為尚未出場的進場則保持不變)
+            for size in [stock_to_buy_position_size, stock_to_sellshort_position_size]:
+                size[1::2] = size[0::2][:len(size[1::2])]
+
+            position_size = pd.DataFrame({
+                'stock_to_buy_position_size': stock_to_buy_position_size,
+                'stock_to_sellshort_position_size': stock_to_sellshort_position_size
+            }, index=self.__position_index)
             # 以張為單位因此乘1000
             return position_size * 1000
 
-        has_position = False
-        positions = pd.Series(0, index=self.signal.index)
         if buy_or_short == 'buy':
             position = 1
         elif buy_or_short == 'short':
@@ -78,18 +85,20 @@ class Strategy:
 
         # 若signal裡的condition_in出現進場訊號且沒有部位則進場
         # 若有部位且signal裡的condition_out出現出場訊號則平倉
-        # 最外層的if用來避免進出場訊號同時出現(訊號會亂掉)
+        # 進出場訊號同時出現時不動作(訊號會亂掉)
         # 此種寫法尚未考量加減碼，透過buy_or_short決定建倉方向
-        for i in range(len(positions)):
-            if self.signal.condition_in.iloc[i] != self.signal.condition_out.iloc[i]:
-                if self.signal.condition_in.iloc[i] == True:
-                    if not has_position:
-                        positions.iloc[i] = position
-                        has_position = True
-                if self.signal.condition_out.iloc[i] == True:
-                    if has_position:
-                        positions.iloc[i] = -1*position
-                        has_position = False
+        condition_in = self.signal.condition_in.values.astype(bool)
+        condition_out = self.signal.condition_out.values.astype(bool)
+        # 只有進場訊號為1，只有出場訊號為-1
+        event = condition_in.astype(int) - condition_out.astype(int)
+        event_index = np.flatnonzero(event)
+        event = event[event_index]
+        # 持有部位若且唯若上一個訊號為進場，因此狀態只在訊號與上一個訊號不同時改變(一開始視為空手)
+        previous_event = np.concatenate([[-1], event[:-1]])
+        is_changed = event != previous_event
+        positions = np.zeros(len(self.signal), dtype=int)
+        positions[event_index[is_changed]] = event[is_changed] * position
+        positions = pd.Series(positions, index=self.signal.index)
 
         # 儲存進出場信號出現時的index           
         self.__position_index = positions[positions != 0].index
@@ -174,7 +183,7 @@ class Strategy:
     def run(
         self, stock_to_buy, stock_to_sellshort,
         condition_in, condition_out,
-        hedge_ratio='auto'
+        hedge_ratio='auto', evaluator=None
     ):
         '''
         stock_to_buy - condition_in成立時欲做多的股票
@@ -184,22 +193,28 @@ class Strategy:
         hedge_ratio - 對沖比率，預設為auto，亦即將兩兩欲交易的價格(trade_on)進行比較，
                       將價格較高者部位設為1，價格較低者部位則由高價除以低價並四捨五入
                       也可以輸入list如：[2, 1]，將會以2:1的部位進行交易(stock_to_buy : stock_to_sellshort)
+        evaluator - 條件為惰性運算式(見expression)時用來計算的Evaluator，
+                    多個策略共用同一個Evaluator時共同的子運算式只計算一次，預設每次run建立新的
         '''
         self.stock_to_buy = stock_to_buy
         self.stock_to_sellshort = stock_to_sellshort
         self.condition_in = condition_in
         self.condition_out = condition_out
         self.hedge_ratio = hedge_ratio
+        self.evaluator = Evaluator() if evaluator is None else evaluator
 
         # 建立訊號
-        self.signal = pd.DataFrame()
-        self.signal['condition_in'] = self.__generate_signal(condition_in)
-        self.signal['condition_out'] = self.__generate_signal(condition_out)
+        with self.__stage('Strategy signal'):
+            self.signal = pd.DataFrame()
+            self.signal['condition_in'] = self.__generate_signal(condition_in)
+            self.signal['condition_out'] = self.__generate_signal(condition_out)
 
         # 建立部位
-        self.signal['stock_to_buy_position'] = self.__generate_position(buy_or_short='buy')
-        self.signal['stock_to_sellshort_position'] = self.__generate_position(buy_or_short='short')
+        with self.__stage('Strategy position'):
+            self.signal['stock_to_buy_position'] = self.__generate_position(buy_or_short='buy')
+            self.signal['stock_to_sellshort_position'] = self.__generate_position(buy_or_short='short')
 
         # 儲存結果
-        self.stock_to_buy_trade_table = self.__generate_trade_table(buy_or_short='buy')
-        self.stock_to_sellshort_trade_table = self.__generate_trade_table(buy_or_short='short')
\ No newline at end of file
+        with self.__stage('Strategy trade table'):
+            self.stock_to_buy_trade_table = self.__generate_trade_table(buy_or_short='buy')
+            self.stock_to_sellshort_trade_table = self.__generate_trade_table(buy_or_short='short')
\ No newline at end of file
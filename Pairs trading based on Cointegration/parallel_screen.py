@@ -0,0 +1,101 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from batch_adf import batch_ADF
+from statistical_functions import batch_test_is_I1, TLS_regresssion
+
+# window price matrix attached by the worker, kept until the next window arrives
+_shared_price = {}
+
+
+def _attach(window):
+    name, shape, dtype = window
+    if name not in _shared_price:
+        for memory, _ in _shared_price.values():
+            memory.close()
+        _shared_price.clear()
+        memory = shared_memory.SharedMemory(name=name)
+        _shared_price[name] = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+    return _shared_price[name][1]
+
+
+def _test_stocks(window, columns, alpha):
+    price = _attach(window)
+    return list(batch_test_is_I1(price[:, columns], alpha))
+
+
+def _test_pairs(window, pairs, alpha):
+    price = _attach(window)
+    stock_1 = price[:, pairs[:, 0]]
+    stock_2 = price[:, pairs[:, 1]]
+    hedge_ratio, intercept = TLS_regresssion(stock_1, stock_2).beta
+    # a rejected pair has a nan hedge ratio, its residual gets p-value 1 from batch_ADF
+    residual = stock_2 - intercept - hedge_ratio*stock_1
+    sigma = residual.std(axis=0)
+    ADF_statistic, pvalue, _ = batch_ADF(residual, trend="n")
+    return [
+        (k, hedge_ratio[k], intercept[k], sigma[k], ADF_statistic[k])
+        for k in np.flatnonzero(pvalue < alpha)
+    ]
+
+
+def screen_universe_parallel(log_price, alpha=0.05, executor=None, max_workers=None, chunk_size=256):
+    '''
+    log_price - dates x codes log-price DataFrame of one model window
+    alpha - significance level of the ADF tests
+    executor - ProcessPoolExecutor reused across windows, None starts one for this call
+    max_workers - number of processes when executor is None, None uses every core
+    chunk_size - number of pairs sent to a worker at once
+
+    Parallel version of screen_universe, the window is copied into shared memory once
+    and workers only receive column indices. Rows are merged in the serial pair order,
+    so ties in the later PS sort are broken the same way.
+    '''
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return screen_universe_parallel(log_price, alpha, executor, chunk_size=chunk_size)
+
+    columns = ['hedge_ratio', 'intercept', 'sigma', 'ADF_statistic']
+    log_price = log_price.dropna(axis=1, how='any')
+    codes = log_price.columns.values
+    price = np.ascontiguousarray(log_price.values, dtype=float)
+
+    memory = shared_memory.SharedMemory(create=True, size=max(price.nbytes, 1))
+    try:
+        np.ndarray(price.shape, dtype=price.dtype, buffer=memory.buf)[:] = price
+        window = (memory.name, price.shape, price.dtype)
+
+        # I(1) test once per stock
+        stock_chunks = np.array_split(np.arange(len(codes)), max(1, len(codes)//8))
+        is_I1 = np.array(list(itertools.chain.from_iterable(
+            executor.map(_test_stocks, itertools.repeat(window), stock_chunks, itertools.repeat(alpha))
+        )), dtype=bool)
+        survivor = np.flatnonzero(is_I1)
+
+        pairs = np.array(list(itertools.combinations(survivor, 2)), dtype=np.intp)
+        if len(pairs) == 0:
+            return pd.DataFrame(columns=columns)
+        # sort code inside pair to prevent possibility of mis-positioning
+        swap = codes[pairs[:, 0]] > codes[pairs[:, 1]]
+        pairs[swap] = pairs[swap][:, ::-1]
+
+        pair_chunks = [pairs[start: start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+        # map keeps the order of the chunks whatever order the workers finish in
+        chunk_results = executor.map(
+            _test_pairs, itertools.repeat(window), pair_chunks, itertools.repeat(alpha)
+        )
+        tradable_pairs = [
+            ((codes[chunk[k, 0]], codes[chunk[k, 1]]), *values)
+            for chunk, result in zip(pair_chunks, chunk_results)
+            for k, *values in result
+        ]
+    finally:
+        memory.close()
+        memory.unlink()
+
+    if len(tradable_pairs) == 0:
+        return pd.DataFrame(columns=columns)
+    index, *values = zip(*tradable_pairs)
+    return pd.DataFrame(dict(zip(columns, values)), columns=columns, index=list(index))
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+# exit reasons by code, 0 keeps the position open
+REASONS = np.array([None, 'cointegration_invalid', 'stop_loss', 'take_profit', 'reversion'], dtype=object)
+COINTEGRATION_INVALID, STOP_LOSS, TAKE_PROFIT, REVERSION = 1, 2, 3, 4
+
+
+def exit_reasons(
+    entry_spread, spread, ASR, stop_loss_sigma_num=6, take_profit_sigma_num=0.5, reversion_exit=True
+):
+    '''
+    entry_spread - spread of the pairs on the entry date
+    spread, ASR - spread and ASR on the checking date, same shape as entry_spread or days x pairs
+
+    Exit rules of the simulation notebook for every element at once, returns the reason codes
+    '''
+    # check whether spread diverge, if diverge then multiplying-term will be <0
+    same_side = spread*entry_spread > 0
+    return np.select(
+        [same_side & (ASR > stop_loss_sigma_num), same_side & (ASR <= take_profit_sigma_num),
+         ~same_side & reversion_exit],
+        [STOP_LOSS, TAKE_PROFIT, REVERSION], 0
+    )
+
+
+class TradeLog:
+    '''
+    columns - numeric columns of the pairs (e.g. hedge_ratio, ..., spread, ASR, PS)
+    capacity - initial number of rows, doubled whenever it is full
+
+    Closed trades kept in preallocated arrays, to_frame builds the trade_result DataFrame once.
+    Every row has a layout, the output columns it fills, so the columns of the DataFrame come in
+    the order the notebook's pd.concat of the single trades gives.
+    '''
+
+    def __init__(self, columns, capacity=256):
+        self.columns = list(columns)
+        self.size = 0
+        self.layouts = []
+        self._layout_id = {}
+        self.pair = np.empty(capacity, dtype=np.int64)
+        self.values_in = np.empty((capacity, len(self.columns)))
+        self.values_out = np.empty((capacity, len(self.columns)))
+        self.date_in = np.empty(capacity, dtype='datetime64[us]')
+        self.date_out = np.empty(capacity, dtype='datetime64[us]')
+        self.reason = np.empty(capacity, dtype=np.int8)
+        self.layout_of = np.empty(capacity, dtype=np.int16)
+
+    def layout(self, out_columns):
+        '''
+        Id of the layout filling out_columns (date included)
+        '''
+        out_columns = tuple(out_columns)
+        if out_columns not in self._layout_id:
+            self._layout_id[out_columns] = len(self.layouts)
+            self.layouts.append(out_columns)
+        return self._layout_id[out_columns]
+
+    def _reserve(self, size):
+        capacity = len(self.pair)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ['pair', 'values_in', 'values_out', 'date_in', 'date_out', 'reason', 'layout_of']:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, pair, values_in, date_in, values_out, date_out, reason, layout):
+        '''
+        Add closed trades, one element (row) per trade
+        '''
+        if self.size == 0:
+            # keep the datetime unit of the input dates
+            self.date_in = self.date_in.astype(np.asarray(date_in).dtype)
+            self.date_out = self.date_out.astype(np.asarray(date_out).dtype)
+        start = self.size
+        stop = start + len(pair)
+        self._reserve(stop)
+        self.pair[start:stop] = pair
+        self.values_in[start:stop] = values_in
+        self.values_out[start:stop] = values_out
+        self.date_in[start:stop] = date_in
+        self.date_out[start:stop] = date_out
+        self.reason[start:stop] = reason
+        self.layout_of[start:stop] = layout
+        self.size = stop
+
+    def to_frame(self, pairs):
+        '''
+        pairs - pair of every pair id
+
+        trade_result DataFrame, *_in columns of the entry, *_out columns of the exit and reason
+        '''
+        if self.size == 0:
+            return pd.DataFrame()
+        size = self.size
+        data = {}
+        for j, column in enumerate(self.columns):
+            data[column + '_in'] = self.values_in[:size, j]
+        data['date_in'] = self.date_in[:size]
+        for j, column in enumerate(self.columns):
+            data[column + '_out'] = self.values_out[:size, j]
+        data['date_out'] = self.date_out[:size]
+        data['reason'] = list(REASONS[self.reason[:size]])
+
+        # columns of the layouts used, in the order they first appear
+        order = [column + '_in' for column in self.columns] + ['date_in']
+        for layout in pd.unique(self.layout_of[:size]):
+            order += [column + '_out' for column in self.layouts[layout] if column + '_out' not in order]
+            if 'reason' not in order:
+                order.append('reason')
+        index = np.empty(size, dtype=object)
+        index[:] = [pairs[pair_id] for pair_id in self.pair[:size]]
+        return pd.DataFrame(data, index=pd.Index(index))[order]
+
+
+class PositionBook:
+    '''
+    columns - columns of the tradable pairs kept for open positions, date is stored apart
+    capacity - initial capacity of the trade log
+
+    Open pairs of the walk-forward loop as arrays keyed by an integer pair id, in the order they
+    were opened (the order exits are checked and logged in the notebook). close removes the pairs
+    of a mask at once and records them in trade_log.
+    '''
+
+    def __init__(self, columns, capacity=256):
+        self.columns = [column for column in columns if column != 'date']
+        self.column_index = dict(zip(self.columns, range(len(self.columns))))
+        self.pairs = []
+        self._pair_id = {}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, len(self.columns)))
+        self.dates = np.empty(0, dtype='datetime64[us]')
+        self.trade_log = TradeLog(self.columns, capacity)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def pair_id(self, pair):
+        '''
+        Integer id of a pair, new pairs get the next id
+        '''
+        if pair not in self._pair_id:
+            self._pair_id[pair] = len(self.pairs)
+            self.pairs.append(pair)
+        return self._pair_id[pair]
+
+    def open_pairs(self):
+        return [self.pairs[pair_id] for pair_id in self.ids]
+
+    def column(self, column):
+        return self.values[:, self.column_index[column]]
+
+    def is_open(self, pairs):
+        '''
+        Whether each of the pairs is open
+        '''
+        open_ids = set(self.ids.tolist())
+        return np.array([self._pair_id.get(pair, -1) in open_ids for pair in pairs], dtype=bool)
+
+    def open(self, pairs):
+        '''
+        pairs - DataFrame of the pairs to open (rows of tradable pairs), appended in order
+        '''
+        if len(pairs) == 0:
+            return
+        if len(self.ids) == 0:
+            self.dates = self.dates.astype(pairs['date'].values.dtype)
+        self.ids = np.append(self.ids, [self.pair_id(pair) for pair in pairs.index])
+        self.values = np.vstack([self.values, pairs[self.columns].values.astype(float)])
+        self.dates = np.append(self.dates, pairs['date'].values.astype(self.dates.dtype))
+
+    def close(self, reason, values_out, date_out, layout):
+        '''
+        reason - reason code of every open pair, 0 keeps it open
+        values_out - open pairs x columns exit values (nan where the layout has no value)
+        date_out - exit date of every open pair (or one date)
+        layout - trade log layout of every open pair (or one layout)
+        '''
+        closed = reason > 0
+        if not closed.any():
+            return
+        self.trade_log.append(
+            self.ids[closed], self.values[closed], self.dates[closed],
+            values_out[closed], np.broadcast_to(date_out, closed.shape)[closed],
+            reason[closed], np.broadcast_to(layout, closed.shape)[closed]
+        )
+        self.ids = self.ids[~closed]
+        self.values = self.values[~closed]
+        self.dates = self.dates[~closed]
+
+    def trade_result(self):
+        return self.trade_log.to_frame(self.pairs)
@@ -0,0 +1,258 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from availability import Availability
+
+
+class PriceStore:
+    '''
+    data - long-format DataFrame, one row per code and date
+    fields - value columns to keep, e.g. ['price'] or ['Close', 'Volume', 'MV'], None keeps every numeric column
+    code_column - name of the code column
+    date_column - name of the date column (datetime)
+
+    Dense dates x codes matrix for each field, built once from the long table.
+    code_index / date_index map a code / date to its column / row, valid marks the cells
+    present in the long table, so a code or a date range is a slice instead of a boolean scan.
+    availability packs valid into bits per code, full-data and common-date checks read those bits.
+    A store saved with save (or written by build_cube) is reopened with open, the matrices are then
+    numpy.memmap files read from disk on demand and every slice of them is a view.
+    '''
+
+    def __init__(self, data, fields=None, code_column='code', date_column='date'):
+        if fields is None:
+            fields = [
+                column for column in data.select_dtypes('number').columns
+                if column not in (code_column, date_column)
+            ]
+        self.fields = list(fields)
+        self.code_column = code_column
+        self.date_column = date_column
+
+        self.codes = np.sort(data[code_column].unique())
+        self.dates = pd.DatetimeIndex(np.sort(data[date_column].unique()))
+        self.code_index = dict(zip(self.codes, range(len(self.codes))))
+        self.date_index = dict(zip(self.dates, range(len(self.dates))))
+
+        row = self.dates.get_indexer(data[date_column])
+        column = pd.Index(self.codes).get_indexer(data[code_column].values)
+        self.valid = np.zeros((len(self.dates), len(self.codes)), dtype=bool)
+        self.valid[row, column] = True
+        self._availability = {}
+        self.values = {}
+        for field in self.fields:
+            matrix = np.full((len(self.dates), len(self.codes)), np.nan)
+            matrix[row, column] = data[field].values
+            self.values[field] = matrix
+
+    @classmethod
+    def from_csv(cls, path, columns=None, date_format='%Y%m%d', **kwargs):
+        '''
+        path - long-format csv, e.g. finance_data.csv
+        columns - new column names, e.g. ['code', 'name', 'date', 'price'] as in the simulation notebook
+        date_format - format of the integer dates in the csv
+        '''
+        data = pd.read_csv(path)
+        if columns is not None:
+            data.columns = columns
+        date_column = kwargs.get('date_column', 'date')
+        data[date_column] = pd.to_datetime(data[date_column].astype(str), format=date_format)
+        return cls(data, **kwargs)
+
+    @classmethod
+    def build_cube(
+        cls, path, directory, columns=None, fields=None, code_column='code', date_column='date',
+        date_format='%Y%m%d', dtype='float64', chunksize=10**6
+    ):
+        '''
+        path - long-format csv, e.g. finance_data.csv
+        directory - folder of the cube
+        columns, date_format - same as from_csv
+        fields - value columns to keep, None keeps every numeric column
+        dtype - dtype of the stored values, float32 halves the size on disk and in memory
+        chunksize - rows of the csv read at once
+
+        Writes the dates x codes cube straight from the csv in chunks without holding the
+        long table in memory: the first pass collects codes and dates, the second one
+        fills the memory-mapped files. Returns the opened store.
+        '''
+        def read_chunks(usecols=None):
+            # usecols refers to the renamed columns
+            for chunk in pd.read_csv(path, chunksize=chunksize):
+                if columns is not None:
+                    chunk.columns = columns
+                chunk = chunk if usecols is None else chunk[usecols]
+                chunk[date_column] = pd.to_datetime(chunk[date_column].astype(str), format=date_format)
+                yield chunk
+
+        codes, dates = [], []
+        for chunk in read_chunks([code_column, date_column]):
+            codes.append(chunk[code_column].unique())
+            dates.append(chunk[date_column].unique())
+        codes = np.unique(np.concatenate(codes))
+        if codes.dtype == object:
+            codes = codes.astype(str)
+        dates = pd.DatetimeIndex(np.unique(np.concatenate(dates)))
+
+        os.makedirs(directory, exist_ok=True)
+        shape = (len(dates), len(codes))
+        valid = np.lib.format.open_memmap(
+            os.path.join(directory, 'valid.npy'), mode='w+', dtype=bool, shape=shape
+        )
+        values = {}
+        for chunk in read_chunks():
+            if fields is None:
+                fields = [
+                    column for column in chunk.select_dtypes('number').columns
+                    if column not in (code_column, date_column)
+                ]
+            for field in fields:
+                if field not in values:
+                    values[field] = np.lib.format.open_memmap(
+                        os.path.join(directory, field + '.npy'), mode='w+', dtype=dtype, shape=shape
+                    )
+                    values[field][:] = np.nan
+            row = dates.get_indexer(chunk[date_column])
+            column = np.searchsorted(codes, chunk[code_column].values)
+            valid[row, column] = True
+            for field in fields:
+                values[field][row, column] = chunk[field].values
+        for matrix in [valid] + list(values.values()):
+            matrix.flush()
+        del valid, values
+
+        cls._save_index(directory, fields, codes, dates, code_column, date_column)
+        return cls.open(directory)
+
+    @staticmethod
+    def _save_index(directory, fields, codes, dates, code_column, date_column):
+        codes = codes.astype(str) if codes.dtype == object else codes
+        np.save(os.path.join(directory, 'codes.npy'), codes, allow_pickle=False)
+        np.save(os.path.join(directory, 'dates.npy'), np.asarray(pd.DatetimeIndex(dates)))
+        with open(os.path.join(directory, 'store.json'), 'w') as file:
+            json.dump({
+                'fields': list(fields), 'code_column': code_column, 'date_column': date_column
+            }, file)
+
+    def save(self, directory):
+        '''
+        directory - folder of the cube, one .npy file per field plus valid, codes and dates
+        '''
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'valid.npy'), self.valid)
+        for field in self.fields:
+            np.save(os.path.join(directory, field + '.npy'), self.values[field])
+        self._save_index(
+            directory, self.fields, self.codes, self.dates, self.code_column, self.date_column
+        )
+
+    @classmethod
+    def open(cls, directory, mode='r'):
+        '''
+        directory - folder written by save or build_cube
+        mode - numpy.memmap mode, r is read-only, r+ writes changes back to the files
+
+        The matrices stay on disk, only the pages that are sliced are read
+        '''
+        with open(os.path.join(directory, 'store.json')) as file:
+            index = json.load(file)
+        store = cls.__new__(cls)
+        store.fields = index['fields']
+        store.code_column = index['code_column']
+        store.date_column = index['date_column']
+        store.codes = np.load(os.path.join(directory, 'codes.npy'), allow_pickle=False)
+        store.dates = pd.DatetimeIndex(np.load(os.path.join(directory, 'dates.npy')))
+        store.code_index = dict(zip(store.codes, range(len(store.codes))))
+        store.date_index = dict(zip(store.dates, range(len(store.dates))))
+        store.valid = np.load(os.path.join(directory, 'valid.npy'), mmap_mode=mode)
+        store._availability = {}
+        store.values = {
+            field: np.load(os.path.join(directory, field + '.npy'), mmap_mode=mode)
+            for field in store.fields
+        }
+        return store
+
+    def rows(self, start=None, end=None):
+        '''
+        Row slice of the dates in [start, end], both ends included
+        '''
+        start_row = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start), side='left')
+        end_row = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end), side='right')
+        return slice(start_row, end_row)
+
+    def columns(self, codes):
+        '''
+        Column positions of the codes
+        '''
+        return np.array([self.code_index[code] for code in codes], dtype=np.intp)
+
+    def get(self, field, codes=None, start=None, end=None):
+        '''
+        dates x codes array of a field, a single code gives one column
+        (a view without copying when codes is None or a single code)
+        '''
+        rows = self.rows(start, end)
+        if codes is None:
+            return self.values[field][rows]
+        if np.isscalar(codes):
+            return self.values[field][rows, self.code_index[codes]]
+        return self.values[field][rows][:, self.columns(codes)]
+
+    def frame(self, field, codes=None, start=None, end=None):
+        '''
+        Same as get but as a DataFrame indexed by date with codes as columns,
+        e.g. np.log(store.frame('price', start=start_date, end=end_date)) for screen_universe
+        '''
+        rows = self.rows(start, end)
+        values = self.get(field, codes, start, end)
+        codes = self.codes if codes is None else np.asarray(codes)
+        # copy=False keeps a view of the (memory-mapped) matrix when codes is None
+        return pd.DataFrame(values, index=self.dates[rows], columns=codes, copy=False)
+
+    def availability(self, field=None):
+        '''
+        field - None for the cells present in the long table (valid), a field for its non-nan values
+
+        Availability bitmap of every code, built on first use and kept
+        '''
+        if field not in self._availability:
+            matrix = self.valid if field is None else self.values[field]
+            self._availability[field] = Availability(matrix, self.codes, self.dates)
+        return self._availability[field]
+
+    def has_full_data(self, start=None, end=None):
+        '''
+        Codes with data on every date in [start, end]
+        '''
+        rows = self.rows(start, end)
+        return self.availability().eligible(rows.start, rows.stop)
+
+    def pairs_with_full_data(self, pairs, start=None, end=None):
+        '''
+        pairs - (code_1, code_2) tuples
+
+        Whether both codes of each pair have data on every date in [start, end],
+        pairs failing it are dropped before any price is sliced
+        '''
+        rows = self.rows(start, end)
+        return self.availability().pair_full(pairs, rows.start, rows.stop)
+
+    def on_date(self, field, date, codes):
+        '''
+        Values of the codes on one date, nan where a code has no data
+        '''
+        row = self.date_index[pd.Timestamp(date)]
+        return self.values[field][row, self.columns(codes)]
+
+    def preprocess(self, code_1, code_2, field='price', start=None, end=None):
+        '''
+        Same idea as statistical_functions.preprocess,
+        returns the dates both codes have data on and the two aligned value arrays
+        (views of the matrix when those dates are contiguous)
+        '''
+        rows = self.rows(start, end)
+        common, values_1, values_2 = self.availability(field).align(
+            self.values[field], code_1, code_2, rows.start, rows.stop
+        )
+        return self.dates[common], values_1, values_2
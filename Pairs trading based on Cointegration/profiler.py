@@ -0,0 +1,165 @@
+import json
+import sys
+import time
+import pandas as pd
+
+
+class _Stage:
+    # timer of one stage call, records itself into the profiler when it exits
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullStage:
+    # shared by every disabled stage, entering and leaving it does nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    '''
+    enabled - False turns every call into a no-op, so instrumented code costs next to nothing
+    progress - write a live progress line on every step (instead of print("  ", current_step))
+    stream - stream of the progress line, None uses sys.stdout
+
+    Wall time per stage and counters, both kept per walk-forward step:
+        profiler = Profiler(progress=True)
+        weeks = screen_weeks(price, profiler=profiler)
+        trade_result = replay(weeks, profiler=profiler)
+        profiler.report()
+    Stages may be nested (e.g. an ADF test inside a screen), the time of each is recorded as is.
+    '''
+
+    def __init__(self, enabled=True, progress=False, stream=None):
+        self.enabled = enabled
+        self.progress = progress
+        self.stream = stream
+        self.timings = {}
+        self.counters = {}
+        # totals over the steps, kept as counts arrive so the progress line does not regroup the counters
+        self._counter_totals = {}
+        self.current_step = None
+        self.total_steps = None
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        '''
+        Context manager timing the code inside it as the stage name
+        '''
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        key = (self.current_step, name)
+        calls, total = self.timings.get(key, (0, 0.0))
+        self.timings[key] = (calls + 1, total + seconds)
+
+    def count(self, name, value=1):
+        '''
+        Add value to the counter name of the current step
+        '''
+        if not self.enabled:
+            return
+        key = (self.current_step, name)
+        self.counters[key] = self.counters.get(key, 0) + value
+        self._counter_totals[name] = self._counter_totals.get(name, 0) + value
+
+    def step(self, step, total=None):
+        '''
+        Start the walk-forward step, later times and counts belong to it
+        '''
+        if not self.enabled:
+            return
+        self.current_step = step
+        if total is not None:
+            self.total_steps = total
+        if self.progress:
+            self._write_progress()
+
+    def _write_progress(self):
+        elapsed = time.perf_counter() - self._start
+        total = '' if self.total_steps is None else '/{}'.format(self.total_steps)
+        counters = '  '.join('{} {}'.format(name, value) for name, value in self._counter_totals.items())
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write('\r   step {}{}  {:.1f}s  {}'.format(self.current_step, total, elapsed, counters))
+        stream.flush()
+
+    def finish(self):
+        '''
+        End the progress line
+        '''
+        if self.enabled and self.progress:
+            stream = sys.stdout if self.stream is None else self.stream
+            stream.write('\n')
+            stream.flush()
+
+    def report(self, by_step=False):
+        '''
+        DataFrame of the stages with calls, seconds and seconds per call,
+        by_step gives one row per (step, stage) instead of the totals
+        '''
+        columns = ['step', 'stage', 'calls', 'seconds']
+        timings = pd.DataFrame(
+            [(step, name, calls, seconds) for (step, name), (calls, seconds) in self.timings.items()],
+            columns=columns
+        )
+        if by_step:
+            timings = timings.set_index(['step', 'stage'])
+        else:
+            timings = timings.groupby('stage', sort=False)[['calls', 'seconds']].sum()
+            timings = timings.sort_values('seconds', ascending=False)
+        timings['seconds_per_call'] = timings.seconds/timings.calls
+        return timings
+
+    def counter_report(self, by_step=False):
+        '''
+        Counters summed over the steps (Series), by_step gives a steps x counters DataFrame
+        '''
+        if not by_step:
+            counters = pd.Series(self._counter_totals)
+            return counters.rename_axis('counter') if len(counters) > 0 else counters
+        counters = pd.Series(self.counters)
+        if len(counters) == 0:
+            return pd.DataFrame()
+        counters.index = counters.index.set_names(['step', 'counter'])
+        return counters.unstack('counter', fill_value=0)
+
+    def to_json(self, path=None):
+        '''
+        Stage timings and counters, per step and in total, as json (written to path if given)
+        '''
+        result = {
+            'stages': self.report().reset_index().to_dict(orient='records'),
+            'counters': self.counter_report().to_dict(),
+            'steps': self.report(by_step=True).reset_index().to_dict(orient='records'),
+            'step_counters': self.counter_report(by_step=True).reset_index().to_dict(orient='records')
+        }
+        text = json.dumps(result, default=str)
+        if path is not None:
+            with open(path, 'w') as file:
+                file.write(text)
+        return text
+
+
+# used when no profiler is given
+NULL_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,258 @@
+import ast
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+METADATA_FILE = 'metadata.json'
+PARQUET_FILE = 'trades.parquet'
+
+
+def _json_default(value):
+    # numpy scalars and other values of the parameters
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _run_name(parameters):
+    return '_'.join('{}_{}'.format(name, value) for name, value in parameters.items()) or 'run'
+
+
+def _to_columns(trade_result):
+    # typed columns of a trade_result: pair codes as integers, dates as datetime64,
+    # text (e.g. reason) as categorical codes with the categories kept in the metadata
+    pairs = list(trade_result.index)
+    if len(pairs) > 0 and all(isinstance(pair, tuple) and len(pair) == 2 for pair in pairs):
+        index = {'code_1': [pair[0] for pair in pairs], 'code_2': [pair[1] for pair in pairs]}
+    else:
+        index = {'pair': pairs}
+    for name, values in index.items():
+        values = np.asarray(values)
+        index[name] = values.astype(str) if values.dtype == object else values
+
+    columns, categories = {}, {}
+    for column in trade_result.columns:
+        values = trade_result[column]
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values) or (
+            pd.api.types.is_datetime64_any_dtype(values)
+        ):
+            columns[column] = values.to_numpy()
+        else:
+            category = pd.Categorical(values)
+            columns[column] = category.codes
+            categories[column] = [str(value) for value in category.categories]
+    return index, columns, categories
+
+
+class ResultStore:
+    '''
+    directory - folder of the store, one sub-folder per run
+
+    Trade results of many runs in typed columnar files with the metadata of each run
+    (parameters, data version, timings), instead of one csv per run:
+        store = ResultStore('result_store')
+        store.save(trade_result, parameters={'ASR_threshold': 2.5, 'top_pairs': 10},
+                   data_version=data_version(price), profiler=profiler)
+        store.runs()                                           # metadata only, one row per run
+        store.scan('ASR_threshold >= 2.5', columns=['date_in', 'date_out', 'reason'])
+    Columns are written as parquet when pyarrow is installed, otherwise as one .npy file per column.
+    Either way a load only reads the columns asked for (the .npy files are memory-mapped).
+    '''
+
+    def __init__(self, directory='result_store'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name, *parts):
+        return os.path.join(self.directory, name, *parts)
+
+    def save(
+        self, trade_result, name=None, parameters=None, data_version=None, timings=None,
+        profiler=None, metadata=None, format=None
+    ):
+        '''
+        trade_result - result of replay (or the notebook's walk-forward loop)
+        name - name of the run, None builds it from the parameters, an existing run is replaced
+        parameters - dict of the replay parameters, used to filter runs
+        data_version - label of the price data, e.g. screening_cache.data_version(price)
+        timings - dict of stage name to seconds
+        profiler - Profiler of the run, its stage totals and counters are stored
+        metadata - any other json-serializable values of the run
+        format - parquet or npy, None uses parquet when pyarrow is installed
+
+        Returns the name of the run
+        '''
+        parameters = dict(parameters or {})
+        name = _run_name(parameters) if name is None else name
+        format = ('parquet' if HAS_PARQUET else 'npy') if format is None else format
+        if format == 'parquet' and not HAS_PARQUET:
+            raise Exception('pyarrow is needed for the parquet format!')
+        if format not in ('parquet', 'npy'):
+            raise Exception('Wrong input of format!')
+
+        index, columns, categories = _to_columns(trade_result)
+        if profiler is not None:
+            timings = dict(timings or {}, **profiler.report().seconds.to_dict())
+            metadata = dict(metadata or {}, counters=profiler.counter_report().to_dict())
+
+        # written to a temporary folder first, a run folder always holds a complete run
+        temporary = self._path(name + '.tmp')
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        if format == 'parquet':
+            frame = pd.DataFrame(dict(index))
+            for column, values in columns.items():
+                frame[column] = (
+                    pd.Categorical.from_codes(values, categories[column])
+                    if column in categories else values
+                )
+            frame.to_parquet(os.path.join(temporary, PARQUET_FILE), index=False)
+        else:
+            for column, values in list(index.items()) + list(columns.items()):
+                np.save(os.path.join(temporary, column + '.npy'), values)
+
+        with open(os.path.join(temporary, METADATA_FILE), 'w') as file:
+            json.dump({
+                'name': name,
+                'format': format,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'rows': len(trade_result),
+                'index': list(index),
+                'columns': list(columns),
+                'categories': categories,
+                'parameters': parameters,
+                'data_version': data_version,
+                'timings': timings or {},
+                'metadata': metadata or {}
+            }, file, indent=2, default=_json_default)
+        shutil.rmtree(self._path(name), ignore_errors=True)
+        os.replace(temporary, self._path(name))
+        return name
+
+    def save_sweep(self, result, prefix='sweep', data_version=None, timings=None, metadata=None):
+        '''
+        result - result of simulation.sweep, indexed by (parameters..., pair)
+
+        Stores every parameter combination of the sweep as its own run, returns their names
+        '''
+        if len(result) == 0:
+            return []
+        parameter_names = list(result.index.names[:-1])
+        names = []
+        for values, trade_result in result.groupby(level=parameter_names, sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            parameters = dict(zip(parameter_names, values))
+            names.append(self.save(
+                trade_result.droplevel(parameter_names), name=prefix + '_' + _run_name(parameters),
+                parameters=parameters, data_version=data_version, timings=timings, metadata=metadata
+            ))
+        return names
+
+    def import_csv(self, path, name=None, parameters=None, data_version=None):
+        '''
+        path - trade result csv written by trade_result.to_csv in the simulation notebook
+
+        Converts an old csv result into a run of the store, returns its name
+        '''
+        trade_result = pd.read_csv(path, index_col=0)
+        trade_result.index = pd.Index(
+            [ast.literal_eval(pair) for pair in trade_result.index], tupleize_cols=False
+        )
+        for column in ['date_in', 'date_out']:
+            if column in trade_result:
+                trade_result[column] = pd.to_datetime(trade_result[column])
+        if name is None and parameters is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        return self.save(trade_result, name=name, parameters=parameters, data_version=data_version)
+
+    def metadata(self, name):
+        with open(self._path(name, METADATA_FILE)) as file:
+            return json.load(file)
+
+    def names(self):
+        '''
+        Names of the complete runs of the store
+        '''
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.exists(self._path(name, METADATA_FILE)) and not name.endswith('.tmp')
+        )
+
+    def runs(self):
+        '''
+        DataFrame of the runs indexed by name, one column per parameter and the total seconds,
+        built from the metadata files only
+        '''
+        rows = []
+        for name in self.names():
+            metadata = self.metadata(name)
+            row = {
+                'created': metadata['created'], 'rows': metadata['rows'],
+                'data_version': metadata['data_version'], 'format': metadata['format'],
+                'seconds': sum(metadata['timings'].values()) if metadata['timings'] else np.nan
+            }
+            row.update(metadata['parameters'])
+            rows.append((name, row))
+        if len(rows) == 0:
+            return pd.DataFrame(columns=['created', 'rows', 'data_version', 'format', 'seconds'])
+        names, rows = zip(*rows)
+        return pd.DataFrame(list(rows), index=pd.Index(names, name='run'))
+
+    def load(self, name, columns=None):
+        '''
+        name - name of the run
+        columns - columns to read, None reads every column
+
+        trade_result of the run, indexed by (code_1, code_2) as the result of replay
+        '''
+        metadata = self.metadata(name)
+        columns = metadata['columns'] if columns is None else list(columns)
+        if metadata['format'] == 'parquet':
+            frame = pd.read_parquet(self._path(name, PARQUET_FILE), columns=metadata['index'] + columns)
+            index = [frame[column].values for column in metadata['index']]
+            data = {column: frame[column] for column in columns}
+        else:
+            def read(column):
+                return np.load(self._path(name, column + '.npy'), mmap_mode='r')
+            index = [read(column) for column in metadata['index']]
+            data = {}
+            for column in columns:
+                values = read(column)
+                if column in metadata['categories']:
+                    values = pd.Categorical.from_codes(values, metadata['categories'][column])
+                data[column] = values
+
+        pairs = list(zip(*[values.tolist() for values in index])) if len(index) == 2 else index[0].tolist()
+        return pd.DataFrame(data, index=pd.Index(pairs, dtype=object, tupleize_cols=False), columns=columns)
+
+    def scan(self, query=None, columns=None, rows=None):
+        '''
+        query - condition on the runs table (see runs), e.g. "ASR_threshold >= 2.5 and top_pairs == 10",
+                None selects every run
+        columns - columns to read, None reads every column
+        rows - condition on the trades of each run, e.g. "reason == 'stop_loss'", applied before
+               the runs are combined
+
+        Trade results of the selected runs in one DataFrame indexed by (run, pair)
+        '''
+        runs = self.runs()
+        if query is not None and len(runs) > 0:
+            runs = runs.query(query)
+        results = []
+        for name in runs.index:
+            trade_result = self.load(name, columns)
+            if rows is not None:
+                trade_result = trade_result.query(rows)
+            results.append(trade_result)
+        if len(results) == 0:
+            return pd.DataFrame()
+        return pd.concat(results, keys=list(runs.index), names=['run', 'pair'])
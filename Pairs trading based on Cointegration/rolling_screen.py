@@ -0,0 +1,256 @@
+import warnings
+import numpy as np
+import pandas as pd
+from batch_adf import batch_ADF
+from statistical_functions import batch_test_is_I1, TLS_slope
+from profiler import NULL_PROFILER
+
+# columns read at once to compute the offsets of RollingScreen
+_OFFSET_COLUMNS = 256
+
+
+def weekly_windows(dates, trailing_windows=52):
+    '''
+    dates - trading dates of the backtest in ascending order
+    trailing_windows - number of weeks used to fit the model
+
+    Rows of the walk-forward loop in the simulation notebook, one tuple per step:
+    (model_start, model_stop, spread_row), the model window is rows [model_start, model_stop)
+    and spread_row is the first trading day of the following week.
+    Weeks are the (year, month, week) timeframe used in the notebook.
+    '''
+    dates = pd.DatetimeIndex(dates)
+    key = pd.DataFrame({
+        'year': dates.year,
+        'month': dates.month,
+        'week': dates.isocalendar().week.values
+    })
+    is_new_week = (key != key.shift()).any(axis=1).values
+    week_start = np.flatnonzero(is_new_week)
+    week_stop = np.append(week_start[1:], len(dates))
+    return [
+        (week_start[step - trailing_windows], week_stop[step - 1], week_start[step])
+        for step in range(trailing_windows, len(week_start))
+    ]
+
+
+class RollingScreen:
+    '''
+    log_price - dates x codes log-price DataFrame of the whole backtest, or prices with take_log. It may be
+                a view of a memory-mapped PriceStore matrix (simulation.price_frame), it is never copied:
+                only the rows added, dropped or screened are read
+    alpha - significance level of the ADF tests
+    prefilter_stat - None (default) runs the full ADF for every pair. Otherwise pairs whose lag-0
+                     Dickey-Fuller statistic of the residual is not below it are rejected without running
+                     the full ADF. This is lossy: the full ADF picks its lags by AIC and can pass pairs with
+                     a higher DF statistic (e.g. -1.0 misses a few pairs with ADF statistics around -2 to -2.5),
+                     so the result then differs from screen_universe
+    refresh_every - rebuild the sums from scratch after this many updates to bound rounding drift
+    profiler - Profiler recording the stages and counters of update and screen
+    chunk_size - number of residuals tested together by the batched ADF
+    take_log - log_price holds prices, their log is taken on the rows read
+
+    Keeps sums, cross-products and lag-1 cross-products of every stock over the current window.
+    Moving the window one week only adds the rows of the new week and removes the rows of
+    the oldest one, TLS fits, residual sigma and the pre-filter come from these sums,
+    and the result has the same layout as screen_universe.
+
+    What is not incremental: screen still reads the whole window once, for the I(1) test of every
+    stock and for the residual ADF of every pair of I(1) stocks, and by default the full ADF runs
+    on all of those pairs at every step. A conservative pre-filter (one that never drops a pair the
+    full ADF accepts) is not provided: the ADF statistic with lags chosen by AIC has no bound that
+    follows from the lag-0 sums, so the only pre-filter is the lossy prefilter_stat, off by default.
+    The sums save the TLS fit and sigma of every pair, not the ADF regressions.
+    '''
+
+    def __init__(self, log_price, alpha=0.05, prefilter_stat=None, refresh_every=52, profiler=None,
+                 chunk_size=4096, take_log=False):
+        self.codes = log_price.columns.values
+        self.dates = log_price.index
+        self.alpha = alpha
+        self.prefilter_stat = prefilter_stat
+        self.refresh_every = refresh_every
+        self.chunk_size = chunk_size
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.take_log = take_log
+        self._source = log_price.values
+
+        # shift each stock by its mean to keep the sums well conditioned,
+        # computed over blocks of columns to keep the memory bounded
+        self._offset = np.zeros(len(self.codes))
+        for start in range(0, len(self.codes), _OFFSET_COLUMNS):
+            price = self._log(np.asarray(self._source[:, start: start + _OFFSET_COLUMNS], dtype=float))
+            with warnings.catch_warnings():
+                # codes without any price get no offset
+                warnings.simplefilter('ignore', RuntimeWarning)
+                self._offset[start: start + _OFFSET_COLUMNS] = np.nanmean(price, axis=0)
+        self._offset[np.isnan(self._offset)] = 0
+
+        self.start = None
+        self.stop = None
+        self._updates = 0
+
+    def _log(self, price):
+        if not self.take_log:
+            return price
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.log(price)
+
+    def _rows(self, start, stop):
+        # rows [start, stop) shifted by the offsets: values (nan where missing), valid mask, values with 0 for nan
+        price = self._log(np.asarray(self._source[start:stop], dtype=float)) - self._offset
+        valid = ~np.isnan(price)
+        return price, valid, np.where(valid, price, 0)
+
+    def _rebuild(self, start, stop):
+        _, valid, rows = self._rows(start, stop)
+        self._count = valid.sum(axis=0)
+        self._sum = rows.sum(axis=0)
+        self._cross = rows.T @ rows
+        self._lag_cross = rows[:-1].T @ rows[1:]
+        self._updates = 0
+
+    def _add(self, start, stop):
+        # read with the current last row, the new rows follow it
+        _, valid, rows = self._rows(start - 1, stop)
+        previous, rows = rows[0], rows[1:]
+        self._count += valid[1:].sum(axis=0)
+        self._sum += rows.sum(axis=0)
+        self._cross += rows.T @ rows
+        self._lag_cross += np.outer(previous, rows[0]) + rows[:-1].T @ rows[1:]
+
+    def _drop(self, start, stop):
+        # read with the new first row, the dropped rows precede it
+        _, valid, rows = self._rows(start, stop + 1)
+        rows, following = rows[:-1], rows[-1]
+        self._count -= valid[:-1].sum(axis=0)
+        self._sum -= rows.sum(axis=0)
+        self._cross -= rows.T @ rows
+        self._lag_cross -= rows[:-1].T @ rows[1:] + np.outer(rows[-1], following)
+
+    def _DF_statistic(self, i, j, hedge_ratio, intercept, first, last):
+        # lag-0 Dickey-Fuller statistic without constant of the residuals stock_j - intercept - hedge_ratio*stock_i,
+        # from the sums over the window without its last row (head) and without its first row (tail),
+        # first and last are the shifted rows of the window with 0 for nan
+        n = self.stop - self.start
+        sum_x, sum_y = self._sum[i], self._sum[j]
+        s_xx, s_yy, s_xy = self._cross[i, i], self._cross[j, j], self._cross[i, j]
+        head = self._residual_square_sum(
+            hedge_ratio, intercept, n - 1, sum_x - last[i], sum_y - last[j],
+            s_xx - last[i]**2, s_yy - last[j]**2, s_xy - last[i]*last[j]
+        )
+        tail = self._residual_square_sum(
+            hedge_ratio, intercept, n - 1, sum_x - first[i], sum_y - first[j],
+            s_xx - first[i]**2, s_yy - first[j]**2, s_xy - first[i]*first[j]
+        )
+        lag = (
+            self._lag_cross[j, j] - hedge_ratio*(self._lag_cross[j, i] + self._lag_cross[i, j]) +
+            hedge_ratio**2*self._lag_cross[i, i] -
+            intercept*(2*sum_y - first[j] - last[j]) +
+            intercept*hedge_ratio*(2*sum_x - first[i] - last[i]) +
+            (n - 1)*intercept**2
+        )
+        # regression diff(e_t) = rho*e_(t-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho = (lag - head)/head
+            squared_residual = tail + head - 2*lag - rho*(lag - head)
+            return rho/np.sqrt(squared_residual/(n - 2)/head)
+
+    @staticmethod
+    def _residual_square_sum(hedge_ratio, intercept, m, sx, sy, sxx, syy, sxy):
+        # sum of (y - intercept - hedge_ratio*x)^2 over m rows with the given sums
+        return (
+            syy + hedge_ratio**2*sxx + m*intercept**2 - 2*hedge_ratio*sxy -
+            2*intercept*sy + 2*intercept*hedge_ratio*sx
+        )
+
+    def update(self, start, stop):
+        '''
+        Move the window to rows [start, stop) of log_price
+        '''
+        is_incremental = (
+            self.start is not None and
+            self.start <= start < self.stop <= stop and
+            self._updates < self.refresh_every
+        )
+        with self.profiler.stage('window update'):
+            if is_incremental:
+                if stop > self.stop:
+                    self._add(self.stop, stop)
+                if start > self.start:
+                    self._drop(self.start, start)
+                self._updates += 1
+            else:
+                self._rebuild(start, stop)
+        self.start, self.stop = start, stop
+
+    def screen(self):
+        '''
+        Tradable pairs of the current window, same layout as screen_universe
+        '''
+        columns = ['hedge_ratio', 'intercept', 'sigma', 'ADF_statistic']
+        profiler = self.profiler
+        n = self.stop - self.start
+        window, _, filled = self._rows(self.start, self.stop)
+
+        # stocks need full data in the window, then the I(1) test once per stock
+        candidate = np.flatnonzero(self._count == n)
+        stock_num = len(self.codes)
+        profiler.count('pairs_considered', stock_num*(stock_num - 1)//2)
+        profiler.count(
+            'pairs_missing_data', (stock_num*(stock_num - 1) - len(candidate)*(len(candidate) - 1))//2
+        )
+        with profiler.stage('I(1) test'):
+            is_I1 = batch_test_is_I1(window[:, candidate] + self._offset[candidate], self.alpha)
+        candidate = candidate[is_I1]
+        candidate = candidate[np.argsort(self.codes[candidate], kind='stable')]
+        profiler.count('stocks_I1', len(candidate))
+        i, j = np.triu_indices(len(candidate), k=1)
+        profiler.count('pairs_I1', len(i))
+        if len(i) == 0:
+            return pd.DataFrame(columns=columns)
+        i, j = candidate[i], candidate[j]
+
+        sum_x, sum_y = self._sum[i], self._sum[j]
+        s_xx, s_yy, s_xy = self._cross[i, i], self._cross[j, j], self._cross[i, j]
+
+        # TLS fit in the shifted coordinates
+        mean_x, mean_y = sum_x/n, sum_y/n
+        c_xx = s_xx - n*mean_x**2
+        c_yy = s_yy - n*mean_y**2
+        c_xy = s_xy - n*mean_x*mean_y
+        hedge_ratio = TLS_slope(c_xx, c_yy, c_xy)
+        intercept = mean_y - hedge_ratio*mean_x
+
+        total = self._residual_square_sum(hedge_ratio, intercept, n, sum_x, sum_y, s_xx, s_yy, s_xy)
+        sigma = np.sqrt(np.maximum(total, 0)/n)
+
+        # pairs without a TLS slope (uncorrelated, vertical major axis) are rejected
+        keep = np.isfinite(hedge_ratio)
+        if self.prefilter_stat is not None:
+            with profiler.stage('prefilter'):
+                passed = self._DF_statistic(i, j, hedge_ratio, intercept, filled[0], filled[-1]) < self.prefilter_stat
+            profiler.count('pairs_prefiltered', (keep & ~passed).sum())
+            keep &= passed
+
+        tradable_pairs = []
+        with profiler.stage('residual ADF test'):
+            kept = np.flatnonzero(keep)
+            for start in range(0, len(kept), self.chunk_size):
+                chunk = kept[start: start + self.chunk_size]
+                residual = window[:, j[chunk]] - intercept[chunk] - hedge_ratio[chunk]*window[:, i[chunk]]
+                ADF_statistic, pvalue, _ = batch_ADF(residual, trend="n")
+                for k, statistic in zip(chunk[pvalue < self.alpha], ADF_statistic[pvalue < self.alpha]):
+                    tradable_pairs.append((
+                        (self.codes[i[k]], self.codes[j[k]]),
+                        hedge_ratio[k],
+                        # back to the original log-price coordinates
+                        intercept[k] + self._offset[j[k]] - hedge_ratio[k]*self._offset[i[k]],
+                        sigma[k], statistic
+                    ))
+        profiler.count('pairs_ADF_passed', len(tradable_pairs))
+
+        if len(tradable_pairs) == 0:
+            return pd.DataFrame(columns=columns)
+        index, *values = zip(*tradable_pairs)
+        return pd.DataFrame(dict(zip(columns, values)), columns=columns, index=list(index))
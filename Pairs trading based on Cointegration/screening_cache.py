@@ -0,0 +1,144 @@
+import hashlib
+import pickle
+import sqlite3
+import time
+import numpy as np
+
+
+def data_version(price):
+    '''
+    price - dates x codes price DataFrame, the whole data or one window
+
+    Content hash of the prices, changes whenever any price, date or code changes
+    '''
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(price.values, dtype=float).tobytes())
+    digest.update(np.asarray(price.index.values).astype('datetime64[ns]').tobytes())
+    digest.update(repr(list(price.columns)).encode())
+    return digest.hexdigest()
+
+
+class ScreeningCache:
+    '''
+    path - sqlite file of the cache
+    max_bytes - size cap of the stored results, least recently used ones are evicted beyond it
+    data_version - label of the price data the results belong to (e.g. data_version(price) of the
+                   whole csv), it is part of every key and invalidate removes other labels
+
+    flush_every - number of hits whose access times are kept in memory before they are written
+
+    Results of the screening stage stored by a hash key, so reruns with the same prices,
+    window and alpha skip the ADF tests and TLS fits.
+    A hit only records its access time in memory, the times are written together by put,
+    close, or after flush_every hits. The total size is kept in memory, so put only reads
+    the table when values have to be evicted.
+    '''
+
+    def __init__(self, path='screening_cache.sqlite', max_bytes=2**30, data_version=None, flush_every=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.data_version = data_version
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.accessed = {}
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, data_version TEXT, value BLOB, size INTEGER, last_access REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+        self.connection.commit()
+        self.total_bytes = self._stored_bytes()
+
+    def key(self, *parts):
+        '''
+        Hash key of the parts (e.g. window dates, codes, alpha) and the data version
+        '''
+        return hashlib.sha1(repr((self.data_version,) + parts).encode()).hexdigest()
+
+    def get(self, key):
+        '''
+        Stored value of the key, None if it is not cached
+        '''
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        try:
+            value = pickle.loads(row[0])
+        except Exception:
+            # written by an incompatible version, treat as not cached
+            self.misses += 1
+            return None
+        self.accessed[key] = time.time()
+        if len(self.accessed) >= self.flush_every:
+            self.flush()
+        self.hits += 1
+        return value
+
+    def flush(self):
+        '''
+        Write the access times of the hits since the last flush
+        '''
+        if self.accessed:
+            self.connection.executemany(
+                'UPDATE cache SET last_access = ? WHERE key = ?',
+                [(accessed, key) for key, accessed in self.accessed.items()]
+            )
+            self.accessed = {}
+        self.connection.commit()
+
+    def put(self, key, value):
+        '''
+        Store a value, then evict the least recently used values beyond max_bytes
+        '''
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        replaced = self.connection.execute('SELECT size FROM cache WHERE key = ?', (key,)).fetchone()
+        if replaced is not None:
+            self.total_bytes -= replaced[0]
+        self.accessed.pop(key, None)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+            (key, self.data_version, blob, len(blob), time.time())
+        )
+        self.total_bytes += len(blob)
+        self._evict()
+        self.flush()
+
+    def _stored_bytes(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # the pending access times decide what is least recently used
+        self.flush()
+        evicted = []
+        rows = self.connection.execute('SELECT key, size FROM cache ORDER BY last_access')
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        rows.close()
+        self.connection.executemany('DELETE FROM cache WHERE key = ?', evicted)
+
+    def invalidate(self, everything=False):
+        '''
+        Remove results of other data versions (all results if everything is True)
+        '''
+        self.flush()
+        if everything:
+            self.connection.execute('DELETE FROM cache')
+        else:
+            self.connection.execute(
+                'DELETE FROM cache WHERE data_version IS NOT ?', (self.data_version,)
+            )
+        self.connection.commit()
+        self.connection.execute('VACUUM')
+        self.total_bytes = self._stored_bytes()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
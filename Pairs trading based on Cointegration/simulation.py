@@ -0,0 +1,505 @@
+import copy
+import inspect
+import itertools
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from rolling_screen import RollingScreen, weekly_windows
+from parallel_screen import screen_universe_parallel
+from screening_cache import data_version
+from position_book import PositionBook, exit_reasons, COINTEGRATION_INVALID
+from profiler import NULL_PROFILER
+from price_store import PriceStore
+
+
+def price_frame(price, field='price'):
+    '''
+    price - dates x codes price DataFrame, or a PriceStore (e.g. PriceStore.open of a cube on disk)
+    field - field of the PriceStore holding the prices
+
+    DataFrame of the prices, a PriceStore gives a view of its (memory-mapped) matrix without copying
+    '''
+    if isinstance(price, PriceStore):
+        return price.frame(field)
+    return price
+
+
+def iter_weeks(
+    price, trailing_windows=52, alpha=0.05, prefilter_stat=None, cache=None, profiler=None, after=None,
+    executor=None, max_workers=None
+):
+    '''
+    after - only screen the weeks whose date is after this date, None screens every week
+    other parameters - same as screen_weeks
+
+    Generator version of screen_weeks, yields the steps one at a time
+    '''
+    if profiler is None:
+        profiler = NULL_PROFILER
+    price = price_frame(price)
+    if executor is not None or max_workers is not None:
+        if prefilter_stat is not None:
+            raise Exception('prefilter_stat is not supported by the parallel screen!')
+        if executor is None:
+            # one pool for every window, the workers keep the attached window between chunks
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                yield from iter_weeks(
+                    price, trailing_windows, alpha, prefilter_stat, cache, profiler, after, executor
+                )
+            return
+
+    if executor is None:
+        # the log is taken on the rows of each update, the price matrix is not copied
+        rolling_screen = RollingScreen(
+            price, alpha=alpha, prefilter_stat=prefilter_stat, profiler=profiler, take_log=True
+        )
+
+    def screen(model_start, model_stop):
+        if executor is None:
+            rolling_screen.update(model_start, model_stop)
+            return rolling_screen.screen()
+        # the window goes to the workers through shared memory, pairs are tested in parallel
+        with profiler.stage('parallel screen'):
+            return screen_universe_parallel(np.log(price.iloc[model_start:model_stop]), alpha, executor)
+
+    windows = weekly_windows(price.index, trailing_windows)
+    if after is not None:
+        windows = [window for window in windows if price.index[window[2]] > after]
+    for step, (model_start, model_stop, spread_row) in enumerate(windows):
+        profiler.step(step, len(windows))
+        if cache is None:
+            tradable_pairs = screen(model_start, model_stop)
+        else:
+            # the key holds the content of the window, so changed prices never hit old results
+            with profiler.stage('cache'):
+                key = cache.key(
+                    'screen_weeks', data_version(price.iloc[model_start:model_stop]),
+                    alpha, prefilter_stat
+                )
+                tradable_pairs = cache.get(key)
+            profiler.count('cache_hits' if tradable_pairs is not None else 'cache_misses')
+            if tradable_pairs is None:
+                tradable_pairs = screen(model_start, model_stop)
+                with profiler.stage('cache'):
+                    cache.put(key, tradable_pairs)
+        spread_price = price.iloc[spread_row]
+
+        # calaulate statistics for tradable pairs
+        with profiler.stage('spread statistics'):
+            code_1 = [pair[0] for pair in tradable_pairs.index]
+            code_2 = [pair[1] for pair in tradable_pairs.index]
+            tradable_pairs['stock_1'] = spread_price.loc[code_1].values
+            tradable_pairs['stock_2'] = spread_price.loc[code_2].values
+            # pairs without a price on the spread date can not be traded this week
+            pair_num = len(tradable_pairs)
+            tradable_pairs = tradable_pairs.dropna(subset=['stock_1', 'stock_2'])
+            profiler.count('pairs_no_spread_price', pair_num - len(tradable_pairs))
+            tradable_pairs[['stock_1_log', 'stock_2_log']] = np.log(
+                tradable_pairs[['stock_1', 'stock_2']].astype(float)
+            )
+            tradable_pairs['spread'] = (
+                tradable_pairs.stock_2_log -
+                tradable_pairs.intercept -
+                tradable_pairs.hedge_ratio*tradable_pairs.stock_1_log
+            )
+            tradable_pairs['ASR'] = abs(tradable_pairs.spread)/tradable_pairs.sigma
+            tradable_pairs['date'] = price.index[spread_row]
+
+        yield {
+            'date': price.index[spread_row],
+            'tradable_pairs': tradable_pairs,
+            'spread_price': spread_price
+        }
+    profiler.finish()
+
+
+def screen_weeks(
+    price, trailing_windows=52, alpha=0.05, prefilter_stat=None, cache=None, profiler=None,
+    executor=None, max_workers=None
+):
+    '''
+    price - dates x codes price DataFrame of the whole backtest (every trading date as a row),
+            or a PriceStore of it (see price_frame)
+    trailing_windows - number of weeks used to fit the model
+    alpha - significance level of the ADF tests
+    prefilter_stat - passed to RollingScreen, None (no prefilter) gives the pairs of screen_universe
+    cache - ScreeningCache, windows whose prices were screened before are read from it
+    profiler - Profiler recording stages and counters per step (step k is weeks[k])
+    executor - ProcessPoolExecutor, every window is screened by screen_universe_parallel on it
+               (shared memory, pairs tested by the workers) instead of the serial RollingScreen
+    max_workers - number of processes of a pool started for the call when executor is None,
+                  None (and no executor) screens serially
+
+    Screening stage of the walk-forward loop in the simulation notebook, one dict per step:
+    date - first trading day of the week the pairs are traded in
+    tradable_pairs - screen result with the spread statistics on that date
+                     (stock_1, stock_2, stock_1_log, stock_2_log, spread, ASR, date)
+    spread_price - price of every code on that date, nan if it has no data
+    None of this depends on the selection and exit thresholds, so it can be replayed many times:
+        price = data_loader.load_price('finance_data.csv')
+        trade_result = replay(screen_weeks(price), price=price)
+    '''
+    return list(iter_weeks(
+        price, trailing_windows, alpha, prefilter_stat, cache, profiler,
+        executor=executor, max_workers=max_workers
+    ))
+
+
+def monitor(
+    book, daily_price, stop_loss_sigma_num=6, take_profit_sigma_num=0.5, reversion_exit=True
+):
+    '''
+    book - PositionBook of the open pairs, with the frozen hedge_ratio, intercept, sigma
+           and the spread on the entry date
+    daily_price - days x codes prices of the trading days between two screening steps
+    other parameters - same as replay
+
+    Applies the exit rules of replay to every open pair on every day with the hedge parameters
+    of the entry, all days and pairs in one pass. Days a pair has no price are skipped.
+    Pairs are closed in the book on the first day a rule is met.
+    '''
+    if len(book) == 0 or len(daily_price) == 0:
+        return
+
+    # a code without a column reads the last, all nan column
+    values = np.column_stack([daily_price.values.astype(float), np.full(len(daily_price), np.nan)])
+    open_pairs = book.open_pairs()
+    stock_1 = values[:, daily_price.columns.get_indexer([pair[0] for pair in open_pairs])]
+    stock_2 = values[:, daily_price.columns.get_indexer([pair[1] for pair in open_pairs])]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stock_1_log = np.log(stock_1)
+        stock_2_log = np.log(stock_2)
+    spread = stock_2_log - book.column('intercept') - book.column('hedge_ratio')*stock_1_log
+    ASR = abs(spread)/book.column('sigma')
+
+    reason = exit_reasons(
+        book.column('spread'), spread, ASR,
+        stop_loss_sigma_num, take_profit_sigma_num, reversion_exit
+    )
+    reason[np.isnan(spread)] = 0
+    day = (reason > 0).argmax(axis=0)
+    pair = np.arange(len(book))
+
+    daily_columns = ['stock_1', 'stock_2', 'stock_1_log', 'stock_2_log', 'spread', 'ASR']
+    values_out = np.full((len(book), len(book.columns)), np.nan)
+    for column, value in zip(daily_columns, [stock_1, stock_2, stock_1_log, stock_2_log, spread, ASR]):
+        values_out[:, book.column_index[column]] = value[day, pair]
+    book.close(
+        reason[day, pair], values_out, daily_price.index.values[day],
+        book.trade_log.layout(daily_columns + ['date'])
+    )
+
+
+def _replay_step(
+    book, week, daily_price, ADF_threshold, ASR_threshold, top_pairs, max_position_num,
+    stop_loss_sigma_num, take_profit_sigma_num, reversion_exit, profiler
+):
+    # one step of replay: daily exits since the previous step, selection, exits and entries,
+    # returns the book (created on the first step)
+    if daily_price is not None and book is not None:
+        closed_num = book.trade_log.size
+        with profiler.stage('monitor'):
+            monitor(book, daily_price, stop_loss_sigma_num, take_profit_sigma_num, reversion_exit)
+        profiler.count('trades_closed', book.trade_log.size - closed_num)
+
+    with profiler.stage('selection'):
+        tradable_pairs = week['tradable_pairs'].copy()
+        tradable_pairs.insert(
+            tradable_pairs.columns.get_loc('date'), 'PS',
+            np.power(tradable_pairs.ASR, (ADF_threshold - tradable_pairs.ADF_statistic))
+        )
+
+        # criteria of target pairs, select from tradable pairs
+        target_pairs = tradable_pairs[tradable_pairs.ASR >= ASR_threshold]
+        target_pairs = target_pairs[target_pairs.ADF_statistic < ADF_threshold]
+        target_pairs = target_pairs.sort_values('PS', ascending=False)
+        target_pairs = target_pairs.iloc[:top_pairs]
+
+    if book is None:
+        book = PositionBook(tradable_pairs.columns)
+        book.open(target_pairs)
+        profiler.count('trades_opened', len(book))
+        return book
+
+    with profiler.stage('exit rules'):
+        # deal for pending stocks, create index for it before dealing for open position
+        # in case of re-selecting those stocks which had been closed during this period
+        pending_target_pairs = target_pairs[~book.is_open(target_pairs.index)]
+
+        # deal for open position stocks, all of them at once
+        open_pairs = book.open_pairs()
+        row = np.array([
+            tradable_pairs.index.get_loc(pair) if pair in tradable_pairs.index else -1
+            for pair in open_pairs
+        ], dtype=np.intp)
+        is_tradable = row >= 0
+        values_out = np.full((len(book), len(book.columns)), np.nan)
+        values_out[is_tradable] = tradable_pairs[book.columns].values[row[is_tradable]]
+        reason = exit_reasons(
+            book.column('spread'), values_out[:, book.column_index['spread']],
+            values_out[:, book.column_index['ASR']],
+            stop_loss_sigma_num, take_profit_sigma_num, reversion_exit
+        )
+
+        # cointegration_invalid, exit at the price of the spread date (0 if no data)
+        reason[~is_tradable] = COINTEGRATION_INVALID
+        invalid_pairs = [pair for pair, valid in zip(open_pairs, is_tradable) if not valid]
+        for k, column in enumerate(['stock_1', 'stock_2']):
+            values_out[~is_tradable, book.column_index[column]] = week['spread_price'].reindex(
+                [pair[k] for pair in invalid_pairs]
+            ).fillna(0).values
+        layout = np.where(
+            is_tradable,
+            book.trade_log.layout(book.columns + ['date']),
+            book.trade_log.layout(['stock_1', 'stock_2', 'date'])
+        )
+        book.close(reason, values_out, np.datetime64(week['date']), layout)
+    profiler.count('trades_closed', int((reason > 0).sum()))
+
+    if len(book) <= max_position_num:
+        opened = pending_target_pairs.iloc[:max_position_num-len(book)]
+        book.open(opened)
+        profiler.count('trades_opened', len(opened))
+    return book
+
+
+def _monitor_tail(book, daily_price, stop_loss_sigma_num, take_profit_sigma_num, reversion_exit, profiler):
+    # days after the last screening step
+    closed_num = book.trade_log.size
+    with profiler.stage('monitor'):
+        monitor(book, daily_price, stop_loss_sigma_num, take_profit_sigma_num, reversion_exit)
+    profiler.count('trades_closed', book.trade_log.size - closed_num)
+
+
+def replay(
+    weeks, ADF_threshold=-3, ASR_threshold=3, top_pairs=30, max_position_num=30,
+    stop_loss_sigma_num=6, take_profit_sigma_num=0.5, reversion_exit=True, price=None,
+    profiler=None
+):
+    '''
+    weeks - result of screen_weeks
+    other parameters - same as the initial part of the simulation notebook
+    price - the price DataFrame (or PriceStore) given to screen_weeks, if given the exit rules are also checked
+            by monitor on every trading day between the screening steps, None only checks them
+            on the screening dates as in the notebook
+    profiler - Profiler recording stages and counters per step (step k is weeks[k])
+
+    Selection and exit part of the walk-forward loop, returns trade_result as in the notebook
+    '''
+    if profiler is None:
+        profiler = NULL_PROFILER
+    if price is not None:
+        price = price_frame(price)
+        spread_rows = price.index.get_indexer([week['date'] for week in weeks])
+
+    book = None
+    for step, week in enumerate(weeks):
+        profiler.step(step, len(weeks))
+        # days after the previous screening step up to this one
+        daily_price = None
+        if price is not None and step > 0:
+            daily_price = price.iloc[spread_rows[step - 1] + 1: spread_rows[step]]
+        book = _replay_step(
+            book, week, daily_price, ADF_threshold, ASR_threshold, top_pairs, max_position_num,
+            stop_loss_sigma_num, take_profit_sigma_num, reversion_exit, profiler
+        )
+
+    if price is not None and book is not None:
+        _monitor_tail(
+            book, price.iloc[spread_rows[-1] + 1:],
+            stop_loss_sigma_num, take_profit_sigma_num, reversion_exit, profiler
+        )
+    profiler.finish()
+
+    if book is None:
+        return pd.DataFrame()
+    with profiler.stage('trade result'):
+        return book.trade_result()
+
+
+# screening result (and daily prices) of the sweep worker, sent once per process
+_weeks = None
+_price = None
+
+
+def _set_weeks(weeks, price=None):
+    global _weeks, _price
+    _weeks = weeks
+    _price = price
+
+
+def _replay(parameter):
+    return replay(_weeks, price=_price, **parameter)
+
+
+def sweep(weeks, param_grid, max_workers=None, price=None):
+    '''
+    weeks - result of screen_weeks, computed once for the whole grid
+    param_grid - dict of parameter name to list of values, e.g.
+                 {'ASR_threshold': [2, 2.5, 3], 'top_pairs': [10, 30], 'stop_loss_sigma_num': [5, 6]}
+    max_workers - number of processes, None uses every core, 1 runs in this process
+    price - passed to replay to check the exit rules daily
+
+    Replays every combination of the grid, returns all trade results in one DataFrame
+    indexed by (parameters..., pair)
+    '''
+    names = list(param_grid)
+    combinations = list(itertools.product(*[param_grid[name] for name in names]))
+    parameters = [dict(zip(names, values)) for values in combinations]
+
+    if max_workers == 1:
+        results = [replay(weeks, price=price, **parameter) for parameter in parameters]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_set_weeks, initargs=(weeks, price)
+        ) as executor:
+            results = list(executor.map(_replay, parameters))
+
+    keys = [values for values, result in zip(combinations, results) if len(result) > 0]
+    results = [result for result in results if len(result) > 0]
+    if len(results) == 0:
+        return pd.DataFrame()
+    return pd.concat(results, keys=keys, names=names + ['pair'])
+
+
+# version of the checkpoint layout, older checkpoints are rejected
+CHECKPOINT_VERSION = 2
+
+
+class WalkForward:
+    '''
+    path - checkpoint file, the state is restored from it when it exists
+    checkpoint_every - number of steps between two checkpoints, the state is also saved at the end
+    daily - check the exit rules on every trading day (replay with price), False only on the screening dates
+    trailing_windows, alpha, prefilter_stat, cache, executor, max_workers - screening parameters,
+                                                                  same as screen_weeks
+    profiler - Profiler recording stages and counters per step
+    parameters - replay parameters (ADF_threshold, ASR_threshold, top_pairs, ...)
+
+    Screening and replay of the walk-forward loop one week at a time, with the state (open positions,
+    closed trades and the last date processed) saved to path:
+        price = data_loader.load_price('finance_data.csv')
+        walk_forward = WalkForward('finance.checkpoint', ASR_threshold=2.5, top_pairs=10)
+        trade_result = walk_forward.run(price)
+    Calling run again resumes after the last checkpoint (e.g. after a crash), and when price has
+    new weeks appended only those are screened and replayed. The prices already processed must not
+    change, run raises otherwise. A run without a checkpoint gives replay(screen_weeks(price)),
+    a resumed one the same up to the rounding of the screen restarting at the resumed window.
+    '''
+
+    def __init__(
+        self, path, checkpoint_every=52, daily=True, trailing_windows=52, alpha=0.05,
+        prefilter_stat=None, cache=None, profiler=None, executor=None, max_workers=None, **parameters
+    ):
+        defaults = {
+            name: parameter.default for name, parameter in inspect.signature(replay).parameters.items()
+            if name not in ('weeks', 'price', 'profiler')
+        }
+        unknown = set(parameters) - set(defaults)
+        if unknown:
+            raise Exception('Wrong input of parameters: {}!'.format(', '.join(sorted(unknown))))
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.cache = cache
+        self.executor = executor
+        self.max_workers = max_workers
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.parameters = dict(defaults, **parameters)
+        # everything the state depends on, a checkpoint of other settings is not resumed
+        self.settings = dict(
+            self.parameters, daily=daily, trailing_windows=trailing_windows,
+            alpha=alpha, prefilter_stat=prefilter_stat
+        )
+
+        self.book = None
+        self.last_date = None
+        self.steps = 0
+        self.codes = None
+        self.end_date = None
+        self.data_version = None
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as file:
+            state = pickle.load(file)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise Exception('Checkpoint {} has an old layout, remove it to start over!'.format(self.path))
+        if state['settings'] != self.settings:
+            raise Exception('Checkpoint {} was written with other parameters!'.format(self.path))
+        self.book = state['book']
+        self.last_date = state['last_date']
+        self.steps = state['steps']
+        self.codes = state['codes']
+        self.end_date = state['end_date']
+        self.data_version = state['data_version']
+
+    def save(self, price, end_date):
+        '''
+        Write the state, the prices up to end_date are the ones processed so far
+        '''
+        self.codes = list(price.columns)
+        self.end_date = end_date
+        self.data_version = data_version(price.loc[:end_date])
+        # write then rename, a crash while saving keeps the previous checkpoint
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as file:
+            pickle.dump({
+                'version': CHECKPOINT_VERSION, 'settings': self.settings, 'book': self.book,
+                'last_date': self.last_date, 'steps': self.steps, 'codes': self.codes,
+                'end_date': self.end_date, 'data_version': self.data_version
+            }, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
+
+    def run(self, price):
+        '''
+        price - dates x codes price DataFrame (or PriceStore) from the start of the backtest, may extend
+                the prices of the previous run with new dates (and new codes)
+
+        Processes the weeks after the checkpoint, returns the trade_result of all the weeks so far
+        '''
+        profiler = self.profiler
+        price = price_frame(price)
+        if self.last_date is not None:
+            # codes listed after the checkpoint do not change the prices processed before
+            processed = price.loc[:self.end_date].reindex(columns=self.codes)
+            if data_version(processed) != self.data_version:
+                raise Exception('Prices processed before have changed, remove the checkpoint to start over!')
+        previous_row = None if self.last_date is None else price.index.get_loc(self.last_date)
+
+        steps = 0
+        for week in iter_weeks(
+            price, self.settings['trailing_windows'], self.settings['alpha'],
+            self.settings['prefilter_stat'], self.cache, profiler, after=self.last_date,
+            executor=self.executor, max_workers=self.max_workers
+        ):
+            row = price.index.get_loc(week['date'])
+            # days after the previous screening step up to this one
+            daily_price = None
+            if self.settings['daily'] and previous_row is not None:
+                daily_price = price.iloc[previous_row + 1: row]
+            self.book = _replay_step(self.book, week, daily_price, profiler=profiler, **self.parameters)
+            previous_row = row
+            self.last_date = week['date']
+            self.steps += 1
+            steps += 1
+            if steps % self.checkpoint_every == 0:
+                self.save(price, self.last_date)
+
+        if self.book is None:
+            return pd.DataFrame()
+        # the checkpoint holds the state at the last step, the days after it are monitored again
+        # by the next run once the following step is known, so their exits keep the order of a full run
+        self.save(price, self.last_date)
+        book = self.book
+        if self.settings['daily']:
+            # exits on the days after the last step only go into the result of this run
+            book = copy.deepcopy(self.book)
+            _monitor_tail(
+                book, price.iloc[previous_row + 1:], self.parameters['stop_loss_sigma_num'],
+                self.parameters['take_profit_sigma_num'], self.parameters['reversion_exit'], profiler
+            )
+        with profiler.stage('trade result'):
+            return book.trade_result()
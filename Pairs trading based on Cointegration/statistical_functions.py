@@ -1,22 +1,48 @@
+import itertools
 import pandas as pd
 import numpy as np
 from arch.unitroot import ADF
 from scipy import odr
+from batch_adf import batch_ADF
+from profiler import NULL_PROFILER
+
+
+def _common_rows(stock_1, stock_2):
+    # positions of the rows without nan whose date the other stock also has (without nan),
+    # the same rows dropna, merge and isin keep but without building any intermediate frame
+    complete_1 = stock_1.notna().values.all(axis=1)
+    complete_2 = stock_2.notna().values.all(axis=1)
+    dates_1, dates_2 = stock_1.date.values, stock_2.date.values
+    if complete_1.all() and complete_2.all() and len(dates_1) == len(dates_2) and (dates_1 == dates_2).all():
+        # already aligned, the common case of a pair from the same price table
+        return np.arange(len(dates_1)), np.arange(len(dates_2))
+    rows_1 = np.flatnonzero(complete_1 & stock_1.date.isin(dates_2[complete_2]).values)
+    rows_2 = np.flatnonzero(complete_2 & stock_2.date.isin(dates_1[complete_1]).values)
+    return rows_1, rows_2
+
+
+def _select_rows(stock, rows):
+    # whole frame or a contiguous block is sliced (no copy under copy-on-write), other rows are taken
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        stock = stock.iloc[rows[0]: rows[-1] + 1]
+    else:
+        stock = stock.iloc[rows]
+    stock = stock.reset_index(drop=True)
+    if not stock.date.is_monotonic_increasing:
+        stock = stock.sort_values(by='date')
+    return stock
 
 
 def preprocess(stock_1, stock_2):
-    stock_1 = stock_1.copy()
-    stock_2 = stock_2.copy()
-    stock_1.dropna(inplace=True)
-    stock_2.dropna(inplace=True)
-    date_index = stock_1.merge(stock_2, on='date')['date']
-    stock_1 = stock_1[stock_1.date.isin(date_index)]
-    stock_1.reset_index(inplace=True, drop=True)
-    stock_1.sort_values(by='date', inplace=True)
-    stock_2 = stock_2[stock_2.date.isin(date_index)]
-    stock_2.reset_index(inplace=True, drop=True)
-    stock_2.sort_values(by='date', inplace=True)
-    return stock_1, stock_2
+    '''
+    stock_1, stock_2 - DataFrames with a date column
+
+    Rows of both stocks on the dates both have complete data, sorted by date with a new index.
+    Only row positions are computed, an aligned pair is returned as slices of the inputs.
+    Codes of a PriceStore are aligned by PriceStore.preprocess without building any DataFrame.
+    '''
+    rows_1, rows_2 = _common_rows(stock_1, stock_2)
+    return _select_rows(stock_1, rows_1), _select_rows(stock_2, rows_2)
 
 
 def test_is_I1(price, alpha=0.05):
@@ -32,29 +58,92 @@ def test_is_I1(price, alpha=0.05):
     return is_I1
 
 
-def TLS_regresssion(stock_1, stock_2):
-    def f(B, x):
-        '''Linear function y = m*x + b'''
-        # B is a vector of the parameters.
-        # x is an array of the current x values.
-        # x is in the same format as the x passed to Data or RealData.
-        # Return an array in the same format as y passed to Data or RealData.
-        return B[0]*x + B[1]
+def batch_test_is_I1(price, alpha=0.05):
+    '''
+    price - dates x stocks array
+
+    test_is_I1 of every stock at once with the batched ADF
+    '''
+    _, price_pvalue, _ = batch_ADF(price)
+    _, return_pvalue, _ = batch_ADF(np.diff(price, axis=0))
+    return (price_pvalue >= alpha) & (return_pvalue < alpha)
+
+
+class TLSResult:
+    '''
+    Result of the closed-form TLS fit, beta = [hedge_ratio, intercept] as in scipy.odr.Output
+    '''
+
+    def __init__(self, beta):
+        self.beta = beta
+
+
+def TLS_slope(s_11, s_22, s_12):
+    '''
+    s_11, s_22, s_12 - centered sums of squares and cross products of stock_1 and stock_2
+
+    Slope of the major eigenvector of [[s_11, s_12], [s_12, s_22]]. For uncorrelated stocks
+    (s_12 == 0) the closed form is 0/0 or x/0: the slope is 0 when stock_1 varies at least as much
+    as stock_2, otherwise the major axis is vertical and the slope is nan, the pair is rejected.
+    '''
+    s_12 = np.asarray(s_12, dtype=float)
+    difference = np.asarray(s_22 - s_11, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hedge_ratio = (difference + np.sqrt(difference**2 + 4*s_12**2)) / (2*s_12)
+        return np.where(s_12 != 0, hedge_ratio, np.where(difference <= 0, 0.0, np.nan))[()]
 
-    linear_model = odr.Model(f)
-    used_data = odr.Data(stock_1, stock_2)
-    TLS_regression_model = odr.ODR(used_data, linear_model, beta0=[1., 2.])
-    result = TLS_regression_model.run()
-    return result
 
+def TLS_regresssion(stock_1, stock_2, method='closed_form'):
+    '''
+    stock_1, stock_2 - 1-D arrays of one pair, or 2-D arrays (observations x pairs) of stacked pairs
+    method - 'closed_form' solves the 2x2 covariance eigenproblem directly (see TLS_slope,
+             the hedge ratio of a rejected pair is nan), 'odr' runs scipy.odr and is kept
+             to validate the closed form (1-D input only)
 
-def test_is_tradable(stock_1, stock_2, alpha=0.05):
+    The closed form is the exact minimizer of the orthogonal distances, ODR stops at its
+    own convergence tolerance, so the two agree to about 1e-6 on cointegrated pairs and
+    within 1e-3 on loosely fitted ones, where the closed form has the smaller sum of squares.
+    '''
+    if method == 'odr':
+        def f(B, x):
+            '''Linear function y = m*x + b'''
+            # B is a vector of the parameters.
+            # x is an array of the current x values.
+            # x is in the same format as the x passed to Data or RealData.
+            # Return an array in the same format as y passed to Data or RealData.
+            return B[0]*x + B[1]
+
+        linear_model = odr.Model(f)
+        used_data = odr.Data(stock_1, stock_2)
+        TLS_regression_model = odr.ODR(used_data, linear_model, beta0=[1., 2.])
+        result = TLS_regression_model.run()
+        return result
+    elif method == 'closed_form':
+        stock_1 = np.asarray(stock_1, dtype=float)
+        stock_2 = np.asarray(stock_2, dtype=float)
+        stock_1_mean = stock_1.mean(axis=0)
+        stock_2_mean = stock_2.mean(axis=0)
+        stock_1_centered = stock_1 - stock_1_mean
+        stock_2_centered = stock_2 - stock_2_mean
+        s_11 = (stock_1_centered * stock_1_centered).sum(axis=0)
+        s_22 = (stock_2_centered * stock_2_centered).sum(axis=0)
+        s_12 = (stock_1_centered * stock_2_centered).sum(axis=0)
+        hedge_ratio = TLS_slope(s_11, s_22, s_12)
+        intercept = stock_2_mean - hedge_ratio*stock_1_mean
+        return TLSResult(np.array([hedge_ratio, intercept]))
+    else:
+        raise ValueError('method must be closed_form or odr')
+
+
+def test_is_tradable(stock_1, stock_2, alpha=0.05, TLS_method='closed_form'):
     stock_1 = np.log(stock_1.values)
     stock_2 = np.log(stock_2.values)
     if (test_is_I1(stock_1) == True) and (test_is_I1(stock_2) == True):
-        TLS_result = TLS_regresssion(stock_1, stock_2)
+        TLS_result = TLS_regresssion(stock_1, stock_2, method=TLS_method)
+        if not np.isfinite(TLS_result.beta[0]):
+            return None
         residual = stock_2 - TLS_result.beta[1] - TLS_result.beta[0]*stock_1
-        residual_ADF_test_result = ADF(residual, trend="nc")
+        residual_ADF_test_result = ADF(residual, trend="n")
         if residual_ADF_test_result.pvalue >= alpha:
             pass
         else:
@@ -67,4 +156,69 @@ def test_is_tradable(stock_1, stock_2, alpha=0.05):
             ])
             return trade_parameter
     else:
-        pass
\ No newline at end of file
+        pass
+
+
+def screen_universe(log_price, alpha=0.05, chunk_size=4096, profiler=None):
+    '''
+    log_price - dates x codes log-price DataFrame of one model window
+    alpha - significance level of the ADF tests
+    chunk_size - number of pairs fitted together, bounds the memory of the batched fit
+    profiler - Profiler recording the stages and counters of the screen
+
+    Same screen as calling test_is_tradable on every pair of codes, but each stock
+    is tested for I(1) once and only pairs of I(1) stocks are fitted.
+    Returns the tradable pairs indexed by (code_1, code_2) with code_1 < code_2.
+    '''
+    columns = ['hedge_ratio', 'intercept', 'sigma', 'ADF_statistic']
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    # stocks without full data in the window can not form any pair
+    stock_num = log_price.shape[1]
+    log_price = log_price.dropna(axis=1, how='any')
+    price = log_price.values
+    codes = log_price.columns.values
+    profiler.count('pairs_considered', stock_num*(stock_num - 1)//2)
+    profiler.count('pairs_missing_data', (stock_num*(stock_num - 1) - len(codes)*(len(codes) - 1))//2)
+
+    # I(1) test for each stock only once
+    with profiler.stage('I(1) test'):
+        is_I1 = batch_test_is_I1(price, alpha)
+    price = price[:, is_I1]
+    codes = codes[is_I1]
+    profiler.count('stocks_I1', len(codes))
+
+    pairs = np.array(list(itertools.combinations(range(len(codes)), 2)), dtype=np.intp)
+    profiler.count('pairs_I1', len(pairs))
+    if len(pairs) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # sort code inside pair to prevent possibility of mis-positioning
+    swap = codes[pairs[:, 0]] > codes[pairs[:, 1]]
+    pairs[swap] = pairs[swap][:, ::-1]
+
+    tradable_pairs = []
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start: start + chunk_size]
+        with profiler.stage('TLS fit'):
+            stock_1 = price[:, chunk[:, 0]]
+            stock_2 = price[:, chunk[:, 1]]
+            hedge_ratio, intercept = TLS_regresssion(stock_1, stock_2).beta
+            # a rejected pair has a nan hedge ratio, its residual gets p-value 1 from batch_ADF
+            residual = stock_2 - intercept - hedge_ratio*stock_1
+            sigma = residual.std(axis=0)
+        with profiler.stage('residual ADF test'):
+            ADF_statistic, pvalue, _ = batch_ADF(residual, trend="n")
+            for k in np.flatnonzero(pvalue < alpha):
+                tradable_pairs.append((
+                    (codes[chunk[k, 0]], codes[chunk[k, 1]]),
+                    hedge_ratio[k], intercept[k],
+                    sigma[k], ADF_statistic[k]
+                ))
+    profiler.count('pairs_ADF_passed', len(tradable_pairs))
+
+    if len(tradable_pairs) == 0:
+        return pd.DataFrame(columns=columns)
+    index, *values = zip(*tradable_pairs)
+    return pd.DataFrame(dict(zip(columns, values)), columns=columns, index=list(index))
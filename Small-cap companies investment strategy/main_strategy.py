@@ -1,5 +1,8 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from price_store import PriceStore
 
 class strategy:
 
@@ -8,12 +11,96 @@ class strategy:
         self.data_year = data_year
         self.data_date = data_date
         self.first_date_each_year = first_date_each_year
+        #code -> column and date -> row indexes of the table, built once so that lookups below are not full-table scans
+        self.store = PriceStore(self.data, fields = [], code_column = "Code", date_column = "Date")
+        self.date_num = len(self.store.dates)
+        self.date_id = self.store.dates.get_indexer(self.data.Date.values)
+        self.code_id = pd.Index(self.store.codes).get_indexer(self.data.Code.values)
+        #rows of the table grouped by date, the rows of date row d are by_date[date_bounds[d]:date_bounds[d + 1]]
+        self.by_date = np.argsort(self.date_id, kind = "stable")
+        self.date_bounds = np.searchsorted(self.date_id[self.by_date], np.arange(self.date_num + 1), side = "left")
+        #trading dates of each code as one sorted key (column * number of dates + date row), by_key holds the row of each key,
+        #so the exit date of many codes can be found with one searchsorted (first trading date on or after date_out for each code)
+        self.by_key = np.argsort(self.code_id * self.date_num + self.date_id, kind = "stable")
+        self.sorted_key = (self.code_id * self.date_num + self.date_id)[self.by_key]
+        self.close = self.data.Close.values.astype(float)
+        self.volume = self.data.Volume.values
+        self.MV = self.data.MV.values.astype(float)
 
-    def calculate_return(self, num_selected = 10, by = "MV", 
-                         ascending = True, least_volume = 10, trade_mode = "A",
-                         weight_mode = "equal", initial_capital = 100, transaction_cost = 0.00585):
-        #empty dataframe to collect final result
-        self.selected_data = pd.DataFrame([])
+    def select_entry(self, date_in, num_selected, by, ascending, least_volume):
+        #rows of the companies selected on date_in, in the same order as sorting the data of that date
+        date_row = self.store.date_index.get(pd.Timestamp(date_in))
+        if date_row is None:
+            rows = np.array([], dtype = np.intp)
+        else:
+            rows = self.by_date[self.date_bounds[date_row]:self.date_bounds[date_row + 1]]
+        #also need to meet the requirement of least trading volume(in case of liquidity risk)
+        rows = rows[self.volume[rows] >= least_volume]
+        #if ascending == true, data will be sorted by appointed column in ascending order(the smaller value the closer to front), vice versa
+        order = pd.Series(self.data[by].values[rows]).sort_values(ascending = ascending).index
+        return rows[order[0:num_selected]]
+
+    def find_exit(self, entry_rows, date_out):
+        #row of the first trading date on or after date_out for the company of each entry row, -1 if the company was unlisted
+        entry_code = self.code_id[entry_rows]
+        date_row_out = self.store.dates.searchsorted(np.asarray(date_out, dtype = "datetime64[ns]"), side = "left")
+        query = entry_code * self.date_num + date_row_out
+        position = np.searchsorted(self.sorted_key, query, side = "left")
+        position_in_range = np.minimum(position, len(self.sorted_key) - 1)
+        found = (position < len(self.sorted_key)) & (self.sorted_key[position_in_range] // self.date_num == entry_code)
+        return np.where(found, self.by_key[position_in_range] if len(self.by_key) > 0 else -1, -1).astype(np.intp)
+
+    def exit_close(self, entry_rows, exit_rows, least_volume, trade_mode):
+        #if the company was unlisted, set exit price = 0
+        listed = exit_rows >= 0
+        close_out = np.where(listed, self.close[exit_rows], 0.0)
+        #then check for the requirement of trade volume
+        low_volume = listed & (self.volume[exit_rows] < least_volume)
+        #in trade mode "A", set exit price = 0,
+        #the strictest condition, because we maybe unable to sell at such a low liquidity, it might means zeros market value at that point
+        if trade_mode == "A":
+            close_out[low_volume] = 0
+        #in trade mode "B", set exit price = entry price,
+        #it means zero return in this stock during the trade, it may undervalue or overvalue depends on different conditions
+        if trade_mode == "B":
+            close_out[low_volume] = self.close[entry_rows[low_volume]]
+        #in trade mode "C", set exit price = price at exit point(regardless of low liquidity),
+        #although that company might has a price on exit point, but we maybe unable to sell at such a low liquidity
+        return close_out
+
+    def exit_price_rows(self, entry_rows, exit_rows, least_volume, trade_mode):
+        #row the exit price of each trade came from, following exit_close, -1 where the exit price is 0
+        listed = exit_rows >= 0
+        low_volume = listed & (self.volume[exit_rows] < least_volume)
+        if trade_mode == "A":
+            return np.where(low_volume, -1, exit_rows)
+        if trade_mode == "B":
+            return np.where(low_volume, entry_rows, exit_rows)
+        return exit_rows
+
+    def compound(self, groups, close_in, close_out, MV, weight_mode, initial_capital, transaction_cost):
+        #assume there is a fund trading different portfolio year by year according to the selected companies,
+        #as a result, we need to calculate the return in a cumulative way to investigate the change of value compare to the start
+        #groups holds the start of each rebalance date in the arrays
+        capital = initial_capital
+        #calculate return for each company in all portfolios at once
+        stock_return = (close_out - close_in) / close_in + 1 - transaction_cost
+        bounds = np.append(groups, len(stock_return))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            #the weight of portfolio will be equally weighted
+            if weight_mode == "equal":
+                weight_array = np.full(end - start, 1/(end - start))
+            #the weight of portfolio will be weighted according to companies' market value
+            if weight_mode == "MVbased":
+                weight_array = MV[start:end] / MV[start:end].sum()
+            #allocation of capital, it will be rebalance year by year
+            capital = np.dot(capital * weight_array, stock_return[start:end])
+        return capital
+
+    def rank_candidates(self, by, ascending, least_volume):
+        #ranked and filtered candidates of each rebalance date with their exit rows,
+        #they do not depend on num_selected, trade_mode or weight_mode so a parameter grid can share them
+        candidates = []
         for i in range(len(self.first_date_each_year)):
             #entry point
             date_in = self.first_date_each_year[i]
@@ -22,78 +109,99 @@ class strategy:
                 date_out = self.first_date_each_year[i + 1]
             except:
                 date_out = self.data_date.iloc[-1, :]["Date"]
-
-            #deal with entry trade 
             #selected companies need to possess trading data on appointed date
-            temp_data_in = self.data[self.data.Date == date_in]
-            #also need to meet the requirement of least trading volume(in case of liquidity risk)
-            temp_data_in = temp_data_in[temp_data_in.Volume >= least_volume]
-            #if ascending == true, data will be sorted by appointed column in ascending order(the smaller value the closer to front), vice versa
-            temp_data_in = temp_data_in.sort_values(by = by, ascending = ascending).reset_index(drop = True)
-            #according to condition of "ascending", select the top "num_selected" rows of data,
-            #e.g. if ascending == True, num_selected = 10, by = "MV", it will select the smallest 10 rows of data according to MV value
-            temp_data_in = temp_data_in.iloc[0:num_selected, :]
-            
-            #deal with exit trade
-            #empty dataframe to collect temp result of exit trade
-            temp_data_out = pd.DataFrame([])
-            for code in temp_data_in.Code:
-                #find the company included in the entry trade above
-                temp_company = self.data[self.data.Code == code]
-                #find the possible exit day according to entry point(later than default exit point, a year after entry point)
-                temp_date_out = pd.DataFrame(temp_company.Date - date_out).Date.apply(lambda x : x.days)
-                try:
-                    #find the closest exit point according to default exit point
-                    temp_date_out = temp_company.Date[temp_date_out[temp_date_out >= 0].idxmin()]
-                    temp_result_out = temp_company[temp_company.Date == temp_date_out]
-                    #change the columns' name of exit point
-                    temp_result_out.columns = (self.data.columns + "_out")
-                    #then check for the requirement of trade volume
-                    if temp_result_out["Volume_out"].values < least_volume:
-                        #in trade mode "A", set exit price = 0,
-                        #the strictest condition, because we maybe unable to sell at such a low liquidity, it might means zeros market value at that point
-                        if trade_mode == "A":
-                            temp_result_out = pd.DataFrame([[0] * len(self.data.columns)], columns = (self.data.columns + "_out"))
-                        #in trade mode "B", set exit price = entry price,
-                        #it means zero return in this stock during the trade, it may undervalue or overvalue depends on different conditions
-                        if trade_mode == "B":
-                            temp_result_out = temp_data_in[temp_data_in.Code == code]
-                            temp_result_out.columns = (self.data.columns + "_out")
-                        #in trade mode "C", set exit price = price at exit point(regardless of low liquidity),
-                        #although that company might has a price on exit point, but we maybe unable to sell at such a low liquidity
-                        if trade_mode == "C":
-                            temp_result_out = temp_result_out      
-                #if the company was unlisted, then for loop would jump to except, set exit price = 0
-                except:
-                    temp_result_out = pd.DataFrame([[0] * len(self.data.columns)], columns = (self.data.columns + "_out"))
-                #combine temp result of exit trade
-                temp_data_out = pd.concat([temp_data_out, temp_result_out], axis = 0)
-                temp_data_out.reset_index(inplace = True, drop = True)
-            #combine temp result of entry trade and exit trade
-            temp_selected_data = pd.concat([temp_data_in,  temp_data_out], axis = 1)
-            #collect final result
-            self.selected_data = pd.concat([self.selected_data, temp_selected_data], axis = 0)
+            entry_rows = self.select_entry(date_in, None, by, ascending, least_volume)
+            exit_rows = self.find_exit(entry_rows, np.repeat(np.datetime64(pd.Timestamp(date_out), "D"), len(entry_rows)))
+            candidates.append((entry_rows, exit_rows))
+        return candidates
+
+    def evaluate(self, candidates, num_selected, least_volume, trade_mode, weight_mode, initial_capital, transaction_cost):
+        #select the top "num_selected" candidates of each rebalance date, returns final capital and the selected rows
+        entry_rows = [rows[0:num_selected] for rows, _ in candidates]
+        exit_rows = [rows[0:num_selected] for _, rows in candidates]
+        groups = np.cumsum([0] + [len(rows) for rows in entry_rows[:-1]])
+        groups = groups[[len(rows) > 0 for rows in entry_rows]]
+        entry_rows = np.concatenate(entry_rows).astype(np.intp) if len(entry_rows) > 0 else np.array([], dtype = np.intp)
+        exit_rows = np.concatenate(exit_rows).astype(np.intp) if len(exit_rows) > 0 else np.array([], dtype = np.intp)
+        #deal with exit trade of all rebalance dates at once
+        close_out = self.exit_close(entry_rows, exit_rows, least_volume, trade_mode)
+        final_capital = self.compound(groups, self.close[entry_rows], close_out, self.MV[entry_rows],
+                                      weight_mode, initial_capital, transaction_cost)
+        return final_capital, entry_rows, exit_rows, close_out
+
+    def calculate_return(self, num_selected = 10, by = "MV", 
+                         ascending = True, least_volume = 10, trade_mode = "A",
+                         weight_mode = "equal", initial_capital = 100, transaction_cost = 0.00585):
+        candidates = self.rank_candidates(by, ascending, least_volume)
+        final_capital, entry_rows, exit_rows, close_out = self.evaluate(
+            candidates, num_selected, least_volume, trade_mode, weight_mode, initial_capital, transaction_cost)
+
+        #collect final result, the data of each entry row and, with suffix "_out", the data of the row its exit price came from
+        #(the entry row in trade mode "B" at low volume), the "_out" columns of a trade with exit price 0 are empty and its Close_out is 0
+        out_rows = self.exit_price_rows(entry_rows, exit_rows, least_volume, trade_mode)
+        data_in = self.data.iloc[entry_rows].reset_index(drop = True)
+        data_out = self.data.iloc[np.maximum(out_rows, 0)].reset_index(drop = True)
+        data_out = data_out.where(np.broadcast_to((out_rows >= 0)[:, None], data_out.shape))
+        data_out["Close"] = close_out
+        data_out.columns = data_out.columns + "_out"
+        self.selected_data = pd.concat([data_in, data_out], axis = 1)
 
         #calculate return
-        self.initial_capital = initial_capital
-        #assume there is a fund trading different portfolio year by year according to the trades in "self.selected_data" above
-        #as a result, we need to calculate the return in a cumulative way to investigate the change of value compare to the start
-        for date in self.selected_data.Date.unique():
-            temp = self.selected_data[self.selected_data.Date == date]
-            #the weight of portfolio will be equally weighted
-            if weight_mode == "equal":
-                weight_array = np.array([1/len(temp)] * len(temp))
-            #the weight of portfolio will be weighted according to companies' market value
-            if weight_mode == "MVbased":
-                weight_array = np.array(temp.MV / temp.MV.sum())
-            #calculate return for each company in the portfolio
-            temp_return =  ((temp.Close_out - temp.Close) / temp.Close + 1 - transaction_cost)
-            #allocation of capital, it will be rebalance year by year
-            capital_allocation = self.initial_capital * weight_array
-            #calculate remain capital year by year
-            self.initial_capital = np.dot(capital_allocation, temp_return)
+        self.initial_capital = final_capital
         #calculate total return
         self_return = (self.initial_capital / initial_capital) -1
         return [self.initial_capital, self_return]
 
+    def calculate_return_grid(self, param_grid, max_workers = 1):
+        #param_grid - dict of parameter name to list of values, e.g. {"num_selected": np.arange(5, 105, 5), "by": ["MV", "PB"], "trade_mode": ["A", "B", "C"]},
+        #parameters not in param_grid take the default values of calculate_return
+        #max_workers - number of processes, 1 runs in this process, None uses every core
+        #returns a DataFrame with one row per parameter set, final_capital and return
+        names = list(param_grid)
+        parameters = [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+        #candidates only depend on (by, ascending, least_volume), so parameter sets sharing them are evaluated together
+        groups = {}
+        for i, parameter in enumerate(parameters):
+            parameter = dict(_GRID_DEFAULT, **parameter)
+            key = (parameter["by"], parameter["ascending"], parameter["least_volume"])
+            groups.setdefault(key, []).append((i, parameter))
+
+        if max_workers == 1:
+            results = [_evaluate_group(self, group) for group in groups.values()]
+        else:
+            with ProcessPoolExecutor(max_workers = max_workers, initializer = _set_worker_strategy, initargs = (self,)) as executor:
+                results = list(executor.map(_evaluate_worker_group, groups.values()))
+
+        #keep the order of the grid
+        results = sorted(itertools.chain.from_iterable(results), key = lambda x : x[0])
+        return pd.DataFrame([row for _, row in results])
+
+
+#default parameters of calculate_return, used by calculate_return_grid
+_GRID_DEFAULT = {"num_selected": 10, "by": "MV", "ascending": True, "least_volume": 10, "trade_mode": "A",
+                "weight_mode": "equal", "initial_capital": 100, "transaction_cost": 0.00585}
+
+
+def _evaluate_group(main, group):
+    #evaluate parameter sets sharing (by, ascending, least_volume) from one ranking of the candidates
+    parameter = group[0][1]
+    candidates = main.rank_candidates(parameter["by"], parameter["ascending"], parameter["least_volume"])
+    results = []
+    for i, parameter in group:
+        final_capital = main.evaluate(candidates, parameter["num_selected"], parameter["least_volume"], parameter["trade_mode"],
+                                      parameter["weight_mode"], parameter["initial_capital"], parameter["transaction_cost"])[0]
+        results.append((i, dict(parameter, final_capital = final_capital, **{"return": (final_capital / parameter["initial_capital"]) -1})))
+    return results
+
+
+#strategy object of the grid worker, sent once per process
+_worker_strategy = None
+
+
+def _set_worker_strategy(main):
+    global _worker_strategy
+    _worker_strategy = main
+
 
+def _evaluate_worker_group(group):
+    return _evaluate_group(_worker_strategy, group)
@@ -0,0 +1,296 @@
+'''
+Benchmarks of the public entry points on synthetic markets (see synthetic_market.py).
+
+    python run_benchmark.py --sizes small medium              # time, compare with baseline.json
+    python run_benchmark.py --sizes small --save-baseline     # store the results as the baseline
+    python run_benchmark.py --sizes small --check             # run the tests in tests/ first
+
+Each benchmark reports seconds (best of the runs), throughput (pairs/s, bars/s or trades/s)
+and peak memory (a separate run under tracemalloc, so it does not slow down the timed runs).
+Timings depend on the machine, so the baseline is not part of the repository: the first run on a
+machine stores its results as baseline.json, later runs compare with it. Times are compared as
+ratios to a fixed calibration loop timed alternately with the benchmark, so a machine that is
+slower or busier does not look like a regression. The exit code is 1 when a benchmark is slower, or uses
+more memory, than the baseline by more than --threshold, or when --check has failing tests.
+The correctness checks (fast paths against the reference implementations) live in tests/ and
+run with pytest alone, the benchmark only times.
+'''
+import argparse
+import gc
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'Pairs trading based on Cointegration'))
+sys.path.insert(0, os.path.join(ROOT, 'Small-cap companies investment strategy'))
+
+from synthetic_market import generate_pairs_market, generate_small_cap_market  # noqa: E402
+from statistical_functions import test_is_tradable, screen_universe  # noqa: E402
+from simulation import screen_weeks  # noqa: E402
+from data_loader import load_price  # noqa: E402
+from pair_trading.strategy import Strategy  # noqa: E402
+from pair_trading.batch_strategy import BatchStrategy  # noqa: E402
+from pair_trading.analysis import Analysis, PortfolioAnalysis  # noqa: E402
+from pair_trading.basic_tool import crossover  # noqa: E402
+from main_strategy import strategy  # noqa: E402
+
+# scaling ladder, number of stocks and years of the synthetic markets
+SIZES = {
+    'small': {'n_stocks': 20, 'years': 2},
+    'medium': {'n_stocks': 60, 'years': 4},
+    'large': {'n_stocks': 150, 'years': 8},
+}
+TESTS = os.path.join(ROOT, 'tests')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class Market:
+    '''
+    Synthetic inputs of one size, built once and shared by the benchmarks
+    '''
+
+    def __init__(self, n_stocks, years, seed=0):
+        self.data, self.planted_pairs = generate_pairs_market(
+            n_stocks=n_stocks, years=years, n_pairs=n_stocks//4, seed=seed
+        )
+        # written as a csv in the layout of finance_data.csv and read back by the data loader
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.directory.name, 'prices.csv')
+        self.data.to_csv(self.csv_path, index=False)
+        self.price = load_price(self.csv_path, cache_path=False)
+        # model window of the last year, test_is_tradable takes prices and screen_universe log prices
+        self.window_price = self.price.iloc[-250:].dropna(axis=1, how='any')
+        self.window = np.log(self.window_price)
+        self.small_cap = generate_small_cap_market(n_stocks=10*n_stocks, years=years, seed=seed)
+
+    def window_pairs(self):
+        codes = sorted(self.window.columns)
+        return list(itertools.combinations(codes, 2))
+
+    def pair_signals(self):
+        # entry when the spread of a planted pair crosses one sigma, exit when it reverts to the mean
+        signals = []
+        for code_1, code_2 in self.planted_pairs.index:
+            prices = self.price[[code_1, code_2]].dropna()
+            spread = np.log(prices[code_2]) - np.log(prices[code_1])
+            mean, sigma = spread.mean(), spread.std()
+            stock_1 = pd.DataFrame({'date': prices.index, 'close': prices[code_1].values})
+            stock_2 = pd.DataFrame({'date': prices.index, 'close': prices[code_2].values})
+            spread = spread.reset_index(drop=True)
+            signals.append((
+                stock_1, stock_2,
+                [crossover(spread, pd.Series(mean + sigma, index=spread.index))],
+                [spread < mean]
+            ))
+        return signals
+
+
+def bench_load_price(market):
+    price = load_price(market.csv_path, cache_path=False)
+    return price.notna().values.sum(), 'rows'
+
+
+def bench_test_is_tradable(market):
+    for code_1, code_2 in market.window_pairs():
+        test_is_tradable(market.window_price[code_1], market.window_price[code_2])
+    return len(market.window_pairs()), 'pairs'
+
+
+def bench_screen_universe(market):
+    screen_universe(market.window)
+    return len(market.window_pairs()), 'pairs'
+
+
+def bench_screen_weeks(market):
+    weeks = screen_weeks(market.price)
+    stock_num = market.price.shape[1]
+    return len(weeks)*stock_num*(stock_num - 1)//2, 'pairs'
+
+
+def bench_screen_weeks_parallel(market):
+    weeks = screen_weeks(market.price, max_workers=os.cpu_count())
+    stock_num = market.price.shape[1]
+    return len(weeks)*stock_num*(stock_num - 1)//2, 'pairs'
+
+
+def bench_strategy_run(market):
+    bars = 0
+    for stock_1, stock_2, condition_in, condition_out in market.pair_signals():
+        Strategy().run(stock_1, stock_2, condition_in, condition_out)
+        bars += len(stock_1)
+    return bars, 'bars'
+
+
+def bench_batch_strategy_run(market):
+    prices = market.price[[code for pair in market.planted_pairs.index for code in pair]].ffill().bfill()
+    log_price = np.log(prices.values)
+    stock_1, stock_2 = prices.values[:, 0::2], prices.values[:, 1::2]
+    spread = log_price[:, 1::2] - log_price[:, 0::2]
+    mean, sigma = spread.mean(axis=0), spread.std(axis=0)
+    previous = np.vstack([np.full((1, spread.shape[1]), np.nan), spread[:-1]])
+    condition_in = (previous < mean + sigma) & (spread > mean + sigma)
+    BatchStrategy().run(stock_1, stock_2, condition_in, spread < mean)
+    return spread.size, 'bars'
+
+
+def bench_analysis_run(market):
+    trades = 0
+    for stock_1, stock_2, condition_in, condition_out in market.pair_signals():
+        trade = Strategy()
+        trade.run(stock_1, stock_2, condition_in, condition_out)
+        analysis = Analysis(trade)
+        analysis.run()
+        trades += len(analysis.stock_to_buy_trade_result)
+    return trades, 'trades'
+
+
+def bench_portfolio_analysis_run(market):
+    strategies = []
+    for stock_1, stock_2, condition_in, condition_out in market.pair_signals():
+        trade = Strategy()
+        trade.run(stock_1, stock_2, condition_in, condition_out)
+        strategies.append(trade)
+    portfolio = PortfolioAnalysis(strategies)
+    portfolio.run()
+    return len(portfolio.daily)*len(strategies), 'bars'
+
+
+def bench_calculate_return(market):
+    main = strategy(*market.small_cap)
+    main.calculate_return(num_selected=20, by='MV', trade_mode='A')
+    return len(market.small_cap[0]), 'bars'
+
+
+BENCHMARKS = {
+    'load_price': bench_load_price,
+    'test_is_tradable': bench_test_is_tradable,
+    'screen_universe': bench_screen_universe,
+    'screen_weeks': bench_screen_weeks,
+    'screen_weeks_parallel': bench_screen_weeks_parallel,
+    'Strategy.run': bench_strategy_run,
+    'BatchStrategy.run': bench_batch_strategy_run,
+    'Analysis.run': bench_analysis_run,
+    'PortfolioAnalysis.run': bench_portfolio_analysis_run,
+    'calculate_return': bench_calculate_return,
+}
+
+
+def _calibration_run(matrix):
+    # a fixed mix of numpy and Python work, the unit the benchmark times are compared in
+    start = time.perf_counter()
+    for _ in range(20):
+        np.sort(matrix @ matrix, axis=0)
+    sum(i*i for i in range(200000))
+    return time.perf_counter() - start
+
+
+def measure(benchmark, market, repeat=3, memory=True, min_seconds=0.5, max_repeat=50):
+    '''
+    Best time of at least repeat runs, throughput and peak memory (MB) of one benchmark.
+    Short benchmarks run until min_seconds (at most max_repeat runs) so that their best time is stable.
+    Every run alternates with a run of the calibration loop, relative is the ratio of the two best
+    times, so it does not move with the speed or the load of the machine at that moment.
+    '''
+    # garbage of the previous benchmarks is not collected during this one
+    gc.collect()
+    matrix = np.random.default_rng(0).normal(size=(200, 200))
+    seconds, calibration = [], []
+    while len(seconds) < repeat or (sum(seconds) < min_seconds and len(seconds) < max_repeat):
+        calibration.append(_calibration_run(matrix))
+        start = time.perf_counter()
+        work, unit = benchmark(market)
+        seconds.append(time.perf_counter() - start)
+    peak_memory = np.nan
+    if memory:
+        tracemalloc.start()
+        benchmark(market)
+        peak_memory = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+    return {
+        'seconds': min(seconds), 'relative': min(seconds)/min(calibration), 'work': int(work), 'unit': unit,
+        'throughput': work/min(seconds), 'peak_memory_mb': float(peak_memory)
+    }
+
+
+def compare(results, baseline, threshold):
+    '''
+    Benchmarks slower or using more memory than the baseline by more than threshold
+    '''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        # times relative to the calibration loop, baselines without it are compared in seconds
+        time_field = 'relative' if 'relative' in baseline[key] else 'seconds'
+        for field in [time_field, 'peak_memory_mb']:
+            old, new = baseline[key].get(field), result[field]
+            if old is None or np.isnan(old) or np.isnan(new):
+                continue
+            if new > old*(1 + threshold):
+                regressions.append('{} {}: {:.4g} -> {:.4g} (+{:.0%})'.format(key, field, old, new, new/old - 1))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['small'], choices=list(SIZES))
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    parser.add_argument('--check', action='store_true', help='run the tests in tests/ before timing')
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = []
+    if args.check:
+        import pytest
+        if pytest.main(['-q', TESTS]) != 0:
+            failures.append('tests in {} failed'.format(TESTS))
+    for size in args.sizes:
+        market = Market(seed=args.seed, **SIZES[size])
+        for name in args.benchmarks:
+            result = measure(BENCHMARKS[name], market, args.repeat, not args.no_memory)
+            results['{}/{}'.format(name, size)] = result
+            print('{:<30} {:>9.3f}s {:>8.2f}x {:>12.1f} {}/s {:>9.1f} MB'.format(
+                name + '/' + size, result['seconds'], result['relative'], result['throughput'],
+                result['unit'], result['peak_memory_mb']
+            ))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        if not args.save_baseline:
+            print('no baseline at', args.baseline, '- the results of this run become the baseline of this machine')
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2)
+        print('baseline saved to', args.baseline)
+    else:
+        with open(args.baseline) as file:
+            failures += compare(results, json.load(file), args.threshold)
+
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# a year of trading days
+DAYS_PER_YEAR = 250
+
+
+def _dates(years, start):
+    return pd.bdate_range(start, periods=int(years*DAYS_PER_YEAR))
+
+
+def _listing_spans(rng, n_stocks, n_dates, delisting_rate, listing_rate):
+    # first and last (exclusive) row of each stock, some list late and some delist early
+    first = np.where(
+        rng.random(n_stocks) < listing_rate, rng.integers(0, n_dates//2, n_stocks), 0
+    )
+    last = np.where(
+        rng.random(n_stocks) < delisting_rate,
+        first + rng.integers(DAYS_PER_YEAR//4, n_dates, n_stocks), n_dates
+    )
+    return first, np.minimum(last, n_dates)
+
+
+def generate_pairs_market(
+    n_stocks=50, years=2, n_pairs=10, delisting_rate=0.05, listing_rate=0.05,
+    missing_rate=0.002, seed=0, start='2010-01-04'
+):
+    '''
+    n_stocks - number of stocks
+    years - length of the market, 250 trading days a year
+    n_pairs - number of planted cointegrated pairs (uses 2*n_pairs of the stocks)
+    delisting_rate / listing_rate - share of stocks delisted early / listed late
+    missing_rate - share of stock days without data
+    seed - seed of the random generator, the same arguments always give the same market
+
+    Random-walk log prices with planted pairs log(stock_2) = intercept + hedge_ratio*log(stock_1) + AR(1) noise.
+    Returns (data, planted_pairs), data has the layout of finance_data.csv
+    (code, name, date as yyyymmdd integer, price), planted_pairs is a DataFrame indexed by
+    (code_1, code_2) with the true hedge_ratio and intercept.
+    '''
+    rng = np.random.default_rng(seed)
+    dates = _dates(years, start)
+    n_dates = len(dates)
+    codes = np.arange(1101, 1101 + n_stocks)
+
+    log_price = np.log(rng.uniform(10, 200, n_stocks)) + np.cumsum(
+        rng.normal(0, 0.02, (n_dates, n_stocks)), axis=0
+    )
+    n_pairs = min(n_pairs, n_stocks//2)
+    hedge_ratio = rng.uniform(0.5, 1.5, n_pairs)
+    intercept = rng.uniform(-0.5, 0.5, n_pairs)
+    # stationary AR(1) spread, innovations shared by nothing else
+    phi = rng.uniform(0.7, 0.95, n_pairs)
+    shock = rng.normal(0, 0.01, (n_dates, n_pairs))
+    noise = np.zeros((n_dates, n_pairs))
+    for t in range(1, n_dates):
+        noise[t] = phi*noise[t - 1] + shock[t]
+    stock_1 = np.arange(0, 2*n_pairs, 2)
+    stock_2 = stock_1 + 1
+    log_price[:, stock_2] = intercept + hedge_ratio*log_price[:, stock_1] + noise
+
+    first, last = _listing_spans(rng, n_stocks, n_dates, delisting_rate, listing_rate)
+    row = np.arange(n_dates)[:, None]
+    available = (row >= first) & (row < last) & (rng.random((n_dates, n_stocks)) >= missing_rate)
+
+    date_row, stock = np.nonzero(available)
+    data = pd.DataFrame({
+        'code': codes[stock],
+        'name': np.char.add('stock_', codes[stock].astype(str)),
+        'date': dates.strftime('%Y%m%d').astype(int).values[date_row],
+        'price': np.round(np.exp(log_price[date_row, stock]), 2)
+    })
+    planted_pairs = pd.DataFrame({
+        'hedge_ratio': hedge_ratio, 'intercept': intercept, 'phi': phi
+    }, index=list(zip(codes[stock_1], codes[stock_2])))
+    return data, planted_pairs
+
+
+def generate_small_cap_market(
+    n_stocks=200, years=3, delisting_rate=0.1, listing_rate=0.2, low_volume_rate=0.05,
+    seed=0, start='2008-01-01'
+):
+    '''
+    n_stocks - number of companies
+    years - length of the market, 250 trading days a year
+    delisting_rate / listing_rate - share of companies delisted early / listed late
+    low_volume_rate - share of company days with a trading volume below 10
+    seed - seed of the random generator
+
+    Returns (data, data_year, data_date, first_date_each_year), the inputs of
+    main_strategy.strategy, data has the columns of the TEJ data
+    (Code, Company, Industry, Date, Open, High, Low, Close, Volume, MV, PB).
+    '''
+    rng = np.random.default_rng(seed)
+    dates = _dates(years, start)
+    n_dates = len(dates)
+    codes = np.arange(1000, 1000 + n_stocks).astype(str)
+
+    close = np.round(rng.uniform(5, 300, n_stocks)*np.exp(np.cumsum(
+        rng.normal(0.0002, 0.02, (n_dates, n_stocks)), axis=0
+    )), 2)
+    shares = rng.lognormal(11, 1.5, n_stocks)
+    volume = rng.integers(10, 5000, (n_dates, n_stocks))
+    is_low_volume = rng.random((n_dates, n_stocks)) < low_volume_rate
+    volume[is_low_volume] = rng.integers(0, 10, is_low_volume.sum())
+    PB = np.round(rng.uniform(0.3, 5, n_stocks)*np.exp(np.cumsum(
+        rng.normal(0, 0.01, (n_dates, n_stocks)), axis=0
+    )), 2)
+
+    first, last = _listing_spans(rng, n_stocks, n_dates, delisting_rate, listing_rate)
+    row = np.arange(n_dates)[:, None]
+    date_row, stock = np.nonzero((row >= first) & (row < last))
+    price = close[date_row, stock]
+    data = pd.DataFrame({
+        'Code': codes[stock],
+        'Company': np.char.add('company_', codes[stock]),
+        'Industry': rng.choice(['M1100', 'M1300', 'M2300', 'M2800'], n_stocks)[stock],
+        'Date': dates[date_row],
+        'Open': price, 'High': price, 'Low': price, 'Close': price,
+        'Volume': volume[date_row, stock],
+        'MV': np.round(price*shares[stock]/1000, 0),
+        'PB': PB[date_row, stock]
+    })
+
+    data_year = data.Date.dt.year.unique()
+    data_date = pd.DataFrame(data.Date.unique(), columns=['Date'])
+    first_date_each_year = list(data_date.groupby(data_date.Date.dt.year).Date.min())
+    return data, data_year, data_date, first_date_each_year
@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmark'))
+sys.path.insert(0, os.path.join(ROOT, 'Pairs trading based on Cointegration'))
+sys.path.insert(0, os.path.join(ROOT, 'Small-cap companies investment strategy'))
+
+from run_benchmark import Market  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def market():
+    # the small synthetic market of the benchmark, 20 stocks over 2 years with 5 planted pairs
+    return Market(n_stocks=20, years=2)
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pair_trading.basic_tool import maximum, minimum, Lag, Maximum, Minimum
+
+
+@pytest.mark.parametrize('window', [1, 2, 5, 20, 37])
+def test_streaming_extremes_match_rolling_with_nan(window):
+    rng = np.random.default_rng(window)
+    closes = rng.normal(size=(300, 4))
+    # single nans and a run longer than the window inside the series
+    closes[rng.random(closes.shape) < 0.05] = np.nan
+    closes[100:100 + window + 3, 1] = np.nan
+    for rolling, streaming in [(maximum, Maximum(window)), (minimum, Minimum(window))]:
+        result = np.array([streaming.update(close) for close in closes])
+        assert np.array_equal(result, rolling(closes, window), equal_nan=True)
+        how = 'max' if rolling is maximum else 'min'
+        expected = getattr(pd.DataFrame(closes).rolling(window), how)().values
+        assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_streaming_extremes_of_one_symbol():
+    closes = np.array([3., 1, np.nan, 4, 1, 5, 9, 2, 6])
+    streaming = Maximum(3)
+    result = np.array([streaming.update(close) for close in closes])
+    assert np.array_equal(result, pd.Series(closes).rolling(3).max().values, equal_nan=True)
+
+
+def test_streaming_operators_need_a_positive_period():
+    with pytest.raises(ValueError):
+        Lag(0)
+    with pytest.raises(ValueError):
+        Maximum(0)
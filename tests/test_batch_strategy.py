@@ -0,0 +1,18 @@
+import numpy as np
+from pair_trading.strategy import Strategy
+from pair_trading.batch_strategy import BatchStrategy
+
+
+def test_batch_strategy_matches_strategy(market):
+    for stock_1, stock_2, condition_in, condition_out in market.pair_signals():
+        single = Strategy()
+        single.run(stock_1, stock_2, condition_in, condition_out)
+        batch = BatchStrategy()
+        batch.run(
+            stock_1.close.values[:, None], stock_2.close.values[:, None],
+            np.asarray(condition_in[0])[:, None], np.asarray(condition_out[0])[:, None]
+        )
+        assert np.allclose(
+            batch.stock_to_buy_trade_table['total_value'][:, 0],
+            single.stock_to_buy_trade_table.total_value.values, equal_nan=True
+        )
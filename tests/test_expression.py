@@ -0,0 +1,10 @@
+import numpy as np
+from pair_trading.expression import source, Evaluator
+
+
+def test_equality_builds_nodes():
+    # == and != of lazy expressions build nodes instead of comparing the node objects
+    spread, mean = np.array([1., 2, 3]), np.array([1., 0, 3])
+    evaluator = Evaluator(spread=spread, mean=mean)
+    assert np.array_equal(evaluator.evaluate(source('spread') == source('mean')), spread == mean)
+    assert np.array_equal(evaluator.evaluate(source('spread') != source('mean')), spread != mean)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+from main_strategy import strategy
+
+
+def test_selected_data_keeps_the_data_columns(market):
+    main = strategy(*market.small_cap)
+    main.calculate_return(num_selected=20, by='MV', trade_mode='B')
+    columns = list(market.small_cap[0].columns)
+    assert list(main.selected_data.columns) == columns + [column + '_out' for column in columns]
+    # a trade without an exit price has empty exit columns and Close_out 0
+    empty = main.selected_data.Date_out.isna()
+    assert (main.selected_data.Close_out[empty] == 0).all()
+    assert (main.selected_data.Code_out[~empty] == main.selected_data.Code[~empty]).all()
+
+
+def test_grid_matches_calculate_return(market):
+    main = strategy(*market.small_cap)
+    grid = main.calculate_return_grid({'num_selected': [5, 20], 'trade_mode': ['A', 'C']})
+    for _, row in grid.iterrows():
+        final_capital, _ = main.calculate_return(num_selected=row.num_selected, trade_mode=row.trade_mode)
+        assert np.isclose(final_capital, row.final_capital)
+    assert grid.equals(pd.DataFrame(main.calculate_return_grid(
+        {'num_selected': [5, 20], 'trade_mode': ['A', 'C']}, max_workers=2
+    )))
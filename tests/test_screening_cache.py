@@ -0,0 +1,44 @@
+import time
+import numpy as np
+from screening_cache import ScreeningCache
+
+
+def _stored_keys(cache):
+    return {row[0] for row in cache.connection.execute('SELECT key FROM cache')}
+
+
+def test_eviction_uses_the_pending_access_times(tmp_path):
+    value = np.zeros(100)
+    cache = ScreeningCache(str(tmp_path/'cache.sqlite'), max_bytes=5000, flush_every=3)
+    for i in range(4):
+        cache.put(cache.key(i), value)
+        time.sleep(0.01)
+    # the hit is only kept in memory, eviction must still see it
+    assert cache.get(cache.key(0)) is not None
+    assert cache.accessed
+    time.sleep(0.01)
+    for i in range(4, 7):
+        cache.put(cache.key(i), value)
+        time.sleep(0.01)
+    keys = _stored_keys(cache)
+    assert cache.key(0) in keys and cache.key(1) not in keys
+    assert cache.total_bytes == cache._stored_bytes() <= 5000
+    cache.close()
+
+
+def test_running_total_size(tmp_path):
+    path = str(tmp_path/'cache.sqlite')
+    cache = ScreeningCache(path, flush_every=2)
+    cache.put(cache.key('a'), np.zeros(100))
+    cache.put(cache.key('a'), np.zeros(10))
+    cache.put(cache.key('b'), np.zeros(10))
+    assert cache.total_bytes == cache._stored_bytes()
+    cache.get(cache.key('a'))
+    cache.get(cache.key('b'))
+    assert not cache.accessed
+    cache.close()
+    cache = ScreeningCache(path, data_version='other')
+    assert cache.total_bytes == cache._stored_bytes() > 0
+    cache.invalidate()
+    assert cache.total_bytes == 0
+    cache.close()
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+from profiler import Profiler
+from screening_cache import ScreeningCache, data_version
+from simulation import screen_weeks, replay, WalkForward
+
+NUMERIC_COLUMNS = ['hedge_ratio', 'intercept', 'sigma', 'ADF_statistic']
+
+
+def _assert_same_screens(weeks, other_weeks):
+    assert len(weeks) == len(other_weeks)
+    for week, other_week in zip(weeks, other_weeks):
+        pairs, other_pairs = week['tradable_pairs'], other_week['tradable_pairs']
+        assert set(pairs.index) == set(other_pairs.index)
+        assert np.allclose(
+            other_pairs.loc[list(pairs.index), NUMERIC_COLUMNS].values.astype(float),
+            pairs[NUMERIC_COLUMNS].values.astype(float), rtol=1e-6
+        )
+
+
+def test_parallel_screen_weeks_matches_serial(market):
+    _assert_same_screens(screen_weeks(market.price), screen_weeks(market.price, max_workers=2))
+
+
+def test_screen_weeks_reads_the_cache(market, tmp_path):
+    cache = ScreeningCache(str(tmp_path/'cache.sqlite'), data_version=data_version(market.price))
+    weeks = screen_weeks(market.price, cache=cache)
+    assert cache.hits == 0
+    cached_weeks = screen_weeks(market.price, cache=cache)
+    assert cache.hits == len(weeks) and cache.misses == len(weeks)
+    _assert_same_screens(weeks, cached_weeks)
+    cache.close()
+
+
+def test_profiler_counter_totals(market):
+    profiler = Profiler()
+    weeks = screen_weeks(market.price, profiler=profiler)
+    replay(weeks, price=market.price, profiler=profiler)
+    by_step = profiler.counter_report(by_step=True)
+    totals = profiler.counter_report()
+    assert by_step.sum().to_dict() == totals.to_dict()
+    assert totals['pairs_considered'] > 0
+
+
+def test_walk_forward_after_a_mid_week_cut_matches_replay(market, tmp_path):
+    # loose thresholds so that pairs are closed on the days around the cut
+    parameters = dict(ADF_threshold=-2, ASR_threshold=1, stop_loss_sigma_num=2, take_profit_sigma_num=0.8)
+    full = replay(screen_weeks(market.price), price=market.price, **parameters)
+    cut = market.price.index[len(market.price)//2 + 3]
+    path = os.path.join(str(tmp_path), 'checkpoint')
+    WalkForward(path, **parameters).run(market.price.loc[:cut])
+    appended = WalkForward(path, **parameters).run(market.price)
+    numeric = full.select_dtypes('number').columns
+    assert appended.index.equals(full.index)
+    assert (appended.reason.values == full.reason.values).all()
+    assert np.allclose(appended[numeric].values, full[numeric].values, equal_nan=True)
@@ -0,0 +1,45 @@
+import numpy as np
+import statistical_functions
+from statistical_functions import screen_universe, TLS_regresssion
+from rolling_screen import RollingScreen
+from batch_adf import batch_ADF
+
+
+def test_screen_universe_matches_test_is_tradable(market):
+    # imported through the module, pytest would collect test_is_tradable as a test
+    reference = {}
+    for pair in market.window_pairs():
+        result = statistical_functions.test_is_tradable(market.window_price[pair[0]], market.window_price[pair[1]])
+        if result is not None:
+            reference[pair] = result.values[0]
+    fast = screen_universe(market.window)
+    assert set(fast.index) == set(reference)
+    assert np.allclose(fast.loc[list(reference)].values, np.array(list(reference.values())), rtol=1e-6)
+
+
+def test_rolling_screen_matches_screen_universe(market):
+    log_price = np.log(market.price)
+    rolling = RollingScreen(log_price, prefilter_stat=None)
+    rolling.update(len(log_price) - 250, len(log_price))
+    result = rolling.screen()
+    fast = screen_universe(market.window)
+    assert set(result.index) == set(fast.index)
+    assert np.allclose(result.loc[list(fast.index)].values, fast.values, rtol=1e-6)
+
+
+def test_TLS_of_uncorrelated_stocks():
+    # slope 0 when stock_1 varies more, rejected (nan) when stock_2 does
+    x, y = np.array([0., 1, 0, -1]), np.array([1., 0, -1, 0])
+    assert TLS_regresssion(2*x, y).beta[0] == 0
+    assert np.isnan(TLS_regresssion(x, 2*y).beta[0])
+
+
+def test_batch_ADF_isolates_a_constant_series(market):
+    # nan and p-value 1 for the constant series, the others unchanged
+    series = np.log(market.window.values)
+    degenerate = np.column_stack([series[:, :1], np.full(len(series), series[0, 0]), series[:, 1:]])
+    stat, _, _ = batch_ADF(series)
+    degenerate_stat, degenerate_pvalue, _ = batch_ADF(degenerate)
+    assert np.isnan(degenerate_stat[1])
+    assert degenerate_pvalue[1] == 1
+    assert np.allclose(np.delete(degenerate_stat, 1), stat)